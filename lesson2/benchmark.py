@@ -0,0 +1,99 @@
+"""
+Benchmark of connector settings against a local aiohttp server, which stands in for real hosts.
+It shows how many requests per second the fetcher can do with the default session (as it was)
+and with the tuned connector. Pages are not written to disk, only connection layer is measured.
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import time
+
+from typing import Callable
+
+import aiohttp
+
+from aiohttp import web
+
+from connector import ConnectorConfig, make_connector
+from main import fetch_page
+
+parser = argparse.ArgumentParser(description="Benchmark of aiohttp connector settings.")
+parser.add_argument("--host", type=str, default="localhost")
+parser.add_argument("--port", type=int, default=8080)
+parser.add_argument("--requests", type=int, default=10_000, help="Requests number per case.")
+parser.add_argument("--concurrency", type=int, default=100)
+parser.add_argument("--page-size", type=int, default=10 * 1024, help="Page size in bytes.")
+
+
+def run_stand_in_server(host: str, port: int, page_size: int) -> None:
+    page = b"x" * page_size
+
+    async def handle_page(_: web.Request) -> web.Response:
+        return web.Response(body=page, content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/{page}", handle_page)
+    web.run_app(app, host=host, port=port, print=None)
+
+
+async def wait_server(url: str) -> None:
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                await fetch_page(session, url)
+                return
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"Stand-in server {url} is not started")
+
+
+async def run_case(
+    make_session: Callable[[], aiohttp.ClientSession],
+    base_url: str,
+    requests_number: int,
+    concurrency: int,
+) -> float:
+    urls = iter(f"{base_url}/page{i}" for i in range(requests_number))
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        for url in urls:
+            await fetch_page(session, url)
+
+    async with make_session() as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+        return requests_number / (time.perf_counter() - start)
+
+
+async def main():
+    args = parser.parse_args()
+    base_url = f"http://{args.host}:{args.port}"
+
+    server = mp.Process(
+        target=run_stand_in_server, args=(args.host, args.port, args.page_size), daemon=True
+    )
+    server.start()
+
+    tuned_config = ConnectorConfig(pool_size=args.concurrency, limit_per_host=args.concurrency)
+    cases = {
+        "default session (before)": lambda: aiohttp.ClientSession(),
+        "no keep-alive, no DNS cache": lambda: aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(force_close=True, use_dns_cache=False)
+        ),
+        "tuned connector (after)": lambda: aiohttp.ClientSession(
+            connector=make_connector(tuned_config)
+        ),
+    }
+
+    try:
+        await wait_server(f"{base_url}/warmup")
+        for name, make_session in cases.items():
+            rps = await run_case(make_session, base_url, args.requests, args.concurrency)
+            print(f"{name}: {rps:.0f} requests per second")
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+import hashlib
+import json
+
+from pathlib import Path
+from typing import NamedTuple
+
+from storage import save_json
+
+
+class CacheEntry(NamedTuple):
+    etag: str | None
+    last_modified: str | None
+    content_hash: str
+
+
+def compute_content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class CacheIndex:
+    """
+    Sidecar index of fetched pages: file name (see `compute_file_name_from_url`) -> validators.
+    It's used to send conditional requests (If-None-Match/If-Modified-Since), so the server
+    can answer 304 without body and the page is not rewritten.
+    Index is a small json file, it's loaded at the start and saved at the end of the run.
+    """
+
+    def __init__(self, file_path: str | Path) -> None:
+        self.file_path = Path(file_path)
+        self._entries: dict[str, CacheEntry] = {}
+        # keys which were set during the run, they are merged from worker processes
+        self._updated_keys: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @classmethod
+    def load(cls, file_path: str | Path) -> "CacheIndex":
+        index = cls(file_path)
+        try:
+            with open(index.file_path, "r") as file_:
+                raw_entries = json.load(file_)
+        except FileNotFoundError:
+            return index
+        except json.JSONDecodeError:
+            # broken index is not a reason to stop, pages will be fetched again
+            print(f"Cache index {index.file_path} is broken and will be rebuilt")
+            return index
+
+        index._entries = {key: CacheEntry(*value) for key, value in raw_entries.items()}
+        return index
+
+    def save(self) -> None:
+        save_json(self.file_path, {key: list(entry) for key, entry in self._entries.items()})
+
+    def get(self, key: str) -> CacheEntry | None:
+        return self._entries.get(key)
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        self._entries[key] = entry
+        self._updated_keys.add(key)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self._updated_keys.add(key)
+
+    def get_updates(self) -> dict[str, CacheEntry | None]:
+        """
+        None means that the entry was deleted.
+        """
+        return {key: self._entries.get(key) for key in self._updated_keys}
+
+    def apply_updates(self, updates: dict[str, CacheEntry | None]) -> None:
+        for key, entry in updates.items():
+            if entry is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = entry
+
+    def get_conditional_headers(self, key: str) -> dict[str, str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return {}
+
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
@@ -0,0 +1,87 @@
+import socket
+
+from typing import NamedTuple
+
+import aiohttp
+
+from aiohttp.abc import AbstractResolver, ResolveResult
+from aiohttp.resolver import DefaultResolver
+
+
+class ConnectorConfig(NamedTuple):
+    # max number of opened connections, it should be not less than number of fetch workers
+    pool_size: int = 100
+    limit_per_host: int = 10
+    # aiohttp caches DNS results only for 10 seconds by default, crawling takes longer
+    dns_cache_ttl: int | None = 300
+    # how long an idle connection is kept in the pool for the next page of the host
+    keepalive_timeout: float = 30
+    # None disables happy eyeballs, IPv6 and IPv4 addresses are tried one by one
+    happy_eyeballs_delay: float | None = 0.25
+    # host -> ip, like `curl --resolve`
+    resolve_overrides: dict[str, str] | None = None
+
+
+class OverrideResolver(AbstractResolver):
+    """
+    Resolves overridden hosts to the given addresses without DNS requests,
+    other hosts are resolved by the default aiohttp resolver.
+    """
+
+    def __init__(self, overrides: dict[str, str]) -> None:
+        self._overrides = {host.lower(): ip for host, ip in overrides.items()}
+        self._resolver = DefaultResolver()
+
+    async def resolve(
+        self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET
+    ) -> list[ResolveResult]:
+        ip = self._overrides.get(host.lower())
+        if ip is None:
+            return await self._resolver.resolve(host, port, family)
+
+        return [
+            ResolveResult(
+                hostname=host,
+                host=ip,
+                port=port,
+                family=socket.AF_INET6 if ":" in ip else socket.AF_INET,
+                proto=0,
+                flags=socket.AI_NUMERICHOST,
+            )
+        ]
+
+    async def close(self) -> None:
+        await self._resolver.close()
+
+
+def parse_resolve_overrides(values: list[str] | None) -> dict[str, str]:
+    """
+    Parse `host:ip` values. IPv6 address can contain colons, so only first colon is a separator.
+    """
+    overrides = {}
+    for value in values or []:
+        host, separator, ip = value.partition(":")
+        if not separator or not host or not ip:
+            raise ValueError(f"Wrong resolve override {value!r}, expected format is host:ip")
+        overrides[host] = ip
+    return overrides
+
+
+def make_connector(config: ConnectorConfig) -> aiohttp.TCPConnector:
+    """
+    Connector must be created inside running event loop and shared by all requests,
+    otherwise connections are not reused.
+    """
+    resolver = None
+    if config.resolve_overrides:
+        resolver = OverrideResolver(config.resolve_overrides)
+
+    return aiohttp.TCPConnector(
+        limit=config.pool_size,
+        limit_per_host=config.limit_per_host,
+        use_dns_cache=True,
+        ttl_dns_cache=config.dns_cache_ttl,
+        keepalive_timeout=config.keepalive_timeout,
+        happy_eyeballs_delay=config.happy_eyeballs_delay,
+        resolver=resolver,
+    )
@@ -1,16 +1,56 @@
 import argparse
 import asyncio
+import hashlib
 import os
-import re
+import uuid
 
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
 from pathlib import Path
-from typing import AsyncIterator
+from typing import AsyncIterator, NamedTuple
 
 import aiohttp
 import aiofiles
+import aiofiles.os
+
+from cache import CacheEntry, CacheIndex, compute_content_hash
+from connector import ConnectorConfig, make_connector, parse_resolve_overrides
+from metrics import MetricsCollector, UrlMetrics, make_trace_config, metrics_monitoring
+from retry import (
+    RETRYABLE_EXCEPTIONS,
+    RETRYABLE_STATUSES,
+    CircuitBreakers,
+    RetryPolicy,
+)
+from scheduler import FetchScheduler, get_host, get_shard_index
+from storage import (
+    COMPRESSIONS,
+    BlobStorage,
+    BlobStorageUpdates,
+    FileStorage,
+    compute_file_name_from_url,
+    is_compression_available,
+)
 
-FETCH_PAGE_TIMEOUT = os.getenv("FETCH_PAGE_TIMEOUT", 2)
+FETCH_PAGE_TIMEOUT = float(os.getenv("FETCH_PAGE_TIMEOUT", 2))
 OUTPUT_DIR = "data/output/"
+CACHE_INDEX_FILE_NAME = ".cache_index.json"
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", 100))
+PER_HOST_LIMIT = int(os.getenv("PER_HOST_LIMIT", 10))
+QUEUE_MAX_SIZE_COEFFICIENT = 2
+READ_AHEAD_SIZE = int(os.getenv("READ_AHEAD_SIZE", 10000))
+DEFAULT_CHUNK_SIZE = int(os.getenv("DEFAULT_CHUNK_SIZE", 64 * 1024))
+RETRIES = int(os.getenv("RETRIES", 3))
+BACKOFF_BASE = float(os.getenv("BACKOFF_BASE", 0.5))
+BACKOFF_MAX = float(os.getenv("BACKOFF_MAX", 10))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+DNS_CACHE_TTL = int(os.getenv("DNS_CACHE_TTL", 300))
+KEEPALIVE_TIMEOUT = float(os.getenv("KEEPALIVE_TIMEOUT", 30))
+HAPPY_EYEBALLS_DELAY = float(os.getenv("HAPPY_EYEBALLS_DELAY", 0.25))
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", 5))
+METRICS_FILE_NAME = "metrics.json"
 
 parser = argparse.ArgumentParser(description="Script for fetching web pages data.")
 parser.add_argument(
@@ -21,6 +61,160 @@ parser.add_argument(
         "For instance: /home/user/dev/async_fetcher/resources.txt"
     )
 )
+parser.add_argument(
+    "--max-concurrency",
+    type=int,
+    default=MAX_CONCURRENCY,
+    help="How many pages can be fetched at the same time.",
+)
+parser.add_argument(
+    "--per-host-limit",
+    type=int,
+    default=PER_HOST_LIMIT,
+    help="How many pages of one host can be fetched at the same time.",
+)
+parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="Write pages to disk by chunks instead of loading the whole page into memory.",
+)
+parser.add_argument(
+    "--chunk-size",
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    help="Chunk size in bytes for the stream mode.",
+)
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="Don't send conditional requests, fetch and rewrite every page.",
+)
+parser.add_argument(
+    "--retries",
+    type=int,
+    default=RETRIES,
+    help="How many times a page is retried after timeout, connection error or 429/5xx status.",
+)
+parser.add_argument(
+    "--backoff-base",
+    type=float,
+    default=BACKOFF_BASE,
+    help="Base delay in seconds of exponential backoff between retries.",
+)
+parser.add_argument(
+    "--breaker-threshold",
+    type=int,
+    default=BREAKER_FAILURE_THRESHOLD,
+    help="Failures in a row after which requests to the host are stopped.",
+)
+parser.add_argument(
+    "--breaker-reset-timeout",
+    type=float,
+    default=BREAKER_RESET_TIMEOUT,
+    help="Seconds after which a stopped host is tried again.",
+)
+parser.add_argument(
+    "--pool-size",
+    type=int,
+    default=None,
+    help="Max number of opened connections. By default it's equal to --max-concurrency.",
+)
+parser.add_argument(
+    "--dns-cache-ttl",
+    type=int,
+    default=DNS_CACHE_TTL,
+    help="How many seconds resolved host addresses are cached.",
+)
+parser.add_argument(
+    "--keepalive-timeout",
+    type=float,
+    default=KEEPALIVE_TIMEOUT,
+    help="How many seconds an idle connection is kept opened for next pages of the host.",
+)
+parser.add_argument(
+    "--happy-eyeballs-delay",
+    type=float,
+    default=HAPPY_EYEBALLS_DELAY,
+    help="Delay in seconds before the next address of the host is tried. 0 disables it.",
+)
+parser.add_argument(
+    "--resolve",
+    action="append",
+    metavar="HOST:IP",
+    help="Use the ip for the host instead of DNS request. Can be passed several times.",
+)
+parser.add_argument(
+    "--storage",
+    choices=("files", "blobs"),
+    default="files",
+    help=(
+        "files - every page is a separate html file, "
+        "blobs - pages are deduplicated by content and appended to one pack file."
+    ),
+)
+parser.add_argument(
+    "--compression",
+    choices=COMPRESSIONS,
+    default="none",
+    help="Compression of pages in blobs storage. zstd requires `zstandard` package.",
+)
+parser.add_argument(
+    "--metrics-interval",
+    type=float,
+    default=METRICS_INTERVAL,
+    help="How often (in seconds) throughput and latency are printed.",
+)
+parser.add_argument(
+    "--metrics-file",
+    type=str,
+    default=str(Path(OUTPUT_DIR, METRICS_FILE_NAME)),
+    help="Path to json file with summary metrics of the run.",
+)
+parser.add_argument(
+    "--metrics-log",
+    type=str,
+    default=None,
+    help="Path to file where metrics of every page are written as json lines.",
+)
+parser.add_argument(
+    "--processes",
+    type=int,
+    default=1,
+    help="Number of processes, urls are split between them by host.",
+)
+
+
+@dataclass
+class FetchContext:
+    session: aiohttp.ClientSession
+    stream: bool = False
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    cache: CacheIndex | None = None
+    storage: FileStorage | BlobStorage = field(default_factory=lambda: FileStorage(OUTPUT_DIR))
+    retry_policy: RetryPolicy = RetryPolicy()
+    breakers: CircuitBreakers = field(default_factory=CircuitBreakers)
+    metrics: MetricsCollector = field(default_factory=MetricsCollector)
+
+
+class PageInfo(NamedTuple):
+    status: int
+    etag: str | None = None
+    last_modified: str | None = None
+    content_hash: str | None = None
+    content_length: int = 0
+
+
+def get_page_info(response: aiohttp.ClientResponse) -> PageInfo:
+    return PageInfo(
+        status=response.status,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+
+
+def has_content_to_save(status: int) -> bool:
+    # body of an error which is going to be retried is not needed
+    return status != HTTPStatus.NOT_MODIFIED and status not in RETRYABLE_STATUSES
 
 
 """
@@ -61,18 +255,18 @@ async def process_url(session: aiohttp.ClientSession, url: str) -> None:
 """
 
 
-def compute_file_name_from_url(url) -> str:
-    result = re.sub(r"[^\w.]", "_", url)
-    return result.strip("_")
-
-
 async def read_lines(file_path: str | Path) -> AsyncIterator[str]:
     async with aiofiles.open(file_path, "r") as file_:
         async for line in file_:
             yield line
 
 
-async def fetch_page(session: aiohttp.ClientSession, url: str) -> bytes:
+async def fetch_page(
+    session: aiohttp.ClientSession,
+    url: str,
+    headers: dict[str, str] | None = None,
+    trace_request_ctx: UrlMetrics | None = None,
+) -> tuple[PageInfo, bytes]:
     """
     This function can be a sync generator. The script will become a little bit slower
     but loading by chunks doesn't load the whole page content into memory, and it can be
@@ -80,6 +274,8 @@ async def fetch_page(session: aiohttp.ClientSession, url: str) -> bytes:
     to handle timeout. I found the way how to do it, but file will be created not fully in this
     case. Then removing of the file should be implemented. I think big pages will be handled by
     timeout and won't be loaded into memory.
+    Stream mode is `fetch_page_to_file`: it writes chunks into a temporary file and removes it
+    if something went wrong.
 
     async def fetch_page_chunks(
         session: aiohttp.ClientSession, url: str, chunk_size: int = DEFAULT_CHUNK_SIZE
@@ -93,40 +289,357 @@ async def fetch_page(session: aiohttp.ClientSession, url: str) -> bytes:
         except TimeoutError:
             print("Timed out waiting for")
     """
-    async with session.get(url) as response:
+    async with session.get(
+        url, headers=headers, trace_request_ctx=trace_request_ctx
+    ) as response:
+        page_info = get_page_info(response)
+        if not has_content_to_save(response.status):
+            return page_info, b""
         # I'm reading bytes, not str, because it's less memory consuming
-        return await response.read()
+        page_content = await response.read()
+        return page_info._replace(content_length=len(page_content)), page_content
+
+
+async def fetch_page_to_file(
+    session: aiohttp.ClientSession,
+    url: str,
+    file_path: Path,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    headers: dict[str, str] | None = None,
+    trace_request_ctx: UrlMetrics | None = None,
+) -> PageInfo:
+    """
+    Memory usage depends on chunk size, not on page size.
+    Chunks are written into a temporary file, and it's renamed only when the whole page
+    is loaded, so there are no half-written pages in the output dir. If timeout happened
+    (it cancels this coroutine) or any other error, temporary file is removed.
+    """
+    tmp_file_path = file_path.with_name(f".{file_path.name}.{uuid.uuid4().hex}.part")
+    try:
+        async with session.get(
+            url, headers=headers, trace_request_ctx=trace_request_ctx
+        ) as response:
+            page_info = get_page_info(response)
+            if not has_content_to_save(response.status):
+                return page_info
+
+            content_hash = hashlib.sha256()
+            content_length = 0
+            async with aiofiles.open(tmp_file_path, "wb") as file_:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    content_hash.update(chunk)
+                    content_length += len(chunk)
+                    await file_.write(chunk)
+        await aiofiles.os.replace(tmp_file_path, file_path)
+    except BaseException:
+        # Sync unlink here, because coroutine can be already cancelled by timeout
+        tmp_file_path.unlink(missing_ok=True)
+        raise
+
+    return page_info._replace(
+        content_hash=content_hash.hexdigest(), content_length=content_length
+    )
 
 
-async def write_file(file_path: str | Path, page_content: bytes) -> None:
-    async with aiofiles.open(file_path, "wb") as file_:
-        await file_.write(page_content)
+async def fetch_page_with_timeout(
+    context: FetchContext, url: str, headers: dict[str, str] | None, url_metrics: UrlMetrics
+) -> tuple[PageInfo, bytes | None]:
+    """
+    In the stream mode page is already written to the file, so content is None.
+    """
+    async with asyncio.timeout(FETCH_PAGE_TIMEOUT):
+        if context.stream:
+            # writing is under timeout too, otherwise a slow page is never finished
+            page_info = await fetch_page_to_file(
+                context.session,
+                url,
+                context.storage.get_file_path(url),
+                context.chunk_size,
+                headers,
+                url_metrics,
+            )
+            return page_info, None
+        return await fetch_page(context.session, url, headers, url_metrics)
+
+
+async def process_url(context: FetchContext, url: str, url_metrics: UrlMetrics) -> str:
+    """
+    Returns outcome: loaded, not_modified, failed, timeout or circuit_open.
+    """
+    file_name = compute_file_name_from_url(url)
+
+    cache_entry = None
+    if context.cache is not None and context.storage.exists(url):
+        # if page was removed, it must be fetched fully
+        cache_entry = context.cache.get(file_name)
+    headers = context.cache.get_conditional_headers(file_name) if cache_entry else None
+
+    host = get_host(url)
+    breaker = context.breakers.get(host)
+    error = None
+    for attempt in range(context.retry_policy.retries + 1):
+        if attempt:
+            await asyncio.sleep(context.retry_policy.get_delay(attempt - 1))
+            url_metrics.retries = attempt
+
+        # breaker is checked before every attempt, it can be opened by other pages of the host
+        if not breaker.allow_request():
+            print(f"Host {host} is not available. Page {url} is skipped.")
+            return "circuit_open"
 
+        try:
+            page_info, page_content = await fetch_page_with_timeout(
+                context, url, headers, url_metrics
+            )
+        except RETRYABLE_EXCEPTIONS as e:
+            breaker.record_failure()
+            error = e
+            continue
+        except aiohttp.ClientError as e:
+            print(f"Page {url} is not loaded: {e!r}")
+            return "failed"
+
+        url_metrics.status = page_info.status
+        if page_info.status in RETRYABLE_STATUSES:
+            breaker.record_failure()
+            error = f"status {page_info.status}"
+            continue
+
+        breaker.record_success()
+        break
+    else:
+        if isinstance(error, TimeoutError):
+            print(f"The long operation timed out. Page {url} is not loaded.")
+            return "timeout"
+        else:
+            print(f"Page {url} is not loaded after {attempt + 1} attempts: {error!r}")
+            return "failed"
+
+    if page_info.status == HTTPStatus.NOT_MODIFIED:
+        return "not_modified"
+
+    if not context.stream:
+        page_info = page_info._replace(content_hash=compute_content_hash(page_content))
+        # server can have no validators, but the content is the same
+        if cache_entry is None or cache_entry.content_hash != page_info.content_hash:
+            await context.storage.save(url, page_content, page_info.content_hash)
+    url_metrics.bytes = page_info.content_length
+
+    if context.cache is not None:
+        if page_info.status == HTTPStatus.OK:
+            context.cache.set(
+                file_name,
+                CacheEntry(
+                    etag=page_info.etag,
+                    last_modified=page_info.last_modified,
+                    content_hash=page_info.content_hash,
+                ),
+            )
+        elif context.cache.get(file_name) is not None:
+            # stored page is an error body now, old validators would give 304 for it
+            context.cache.delete(file_name)
+    return "loaded"
+
+
+async def fetch_worker(context: FetchContext, scheduler: FetchScheduler) -> None:
+    while True:
+        url = await scheduler.get()
+        if url is None:
+            break
+
+        url_metrics = UrlMetrics(url=url)
+        try:
+            url_metrics.outcome = await process_url(context, url, url_metrics)
+        except Exception as e:
+            # one broken page must not stop the worker
+            print(f"Error while processing page {url}: {e!r}")
+            url_metrics.outcome = "error"
+        finally:
+            context.metrics.record(url_metrics)
+            await scheduler.task_done(url)
+
+
+class CrawlResult(NamedTuple):
+    metrics: MetricsCollector
+    cache_updates: dict[str, CacheEntry | None] | None
+    storage_updates: BlobStorageUpdates | None
+
+
+def validate_args(args: argparse.Namespace) -> None:
+    if args.max_concurrency < 1:
+        parser.error("--max-concurrency must be a positive number")
+    if args.per_host_limit < 1:
+        parser.error("--per-host-limit must be a positive number")
+    if args.stream and args.storage == "blobs":
+        parser.error("--stream mode writes pages directly to files, it works only with files storage")
+    if not is_compression_available(args.compression):
+        parser.error("zstd compression requires `zstandard` package to be installed")
+    if args.processes < 1:
+        parser.error("--processes must be a positive number")
+    # parsed once here, so a wrong value is reported before any worker process is started
+    try:
+        args.resolve_overrides = parse_resolve_overrides(args.resolve)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def make_storage(args: argparse.Namespace, shard: int | None = None) -> FileStorage | BlobStorage:
+    if args.storage == "files":
+        return FileStorage(OUTPUT_DIR)
+    if shard is None:
+        return BlobStorage(OUTPUT_DIR, compression=args.compression)
+    return BlobStorage(
+        OUTPUT_DIR, compression=args.compression, pack_file_name=f"pages.{shard}.pack"
+    )
 
-async def process_url(session: aiohttp.ClientSession, url: str) -> None:
-    output_file_path = Path(OUTPUT_DIR, f"{compute_file_name_from_url(url)}.html")
 
-    try:
-        async with asyncio.timeout(FETCH_PAGE_TIMEOUT):
-            page_content = await fetch_page(session, url)
-    except TimeoutError:
-        print(f"The long operation timed out. Page {url} is not loaded.")
-    else:
-        await write_file(output_file_path, page_content)
+async def crawl(args: argparse.Namespace, shard: int | None = None) -> CrawlResult:
+    """
+    If shard is passed, only urls of this shard are fetched, and it's run in a worker process.
+    In this case cache index, storage manifest and metrics summary are not saved, they are
+    returned to the main process and merged there (processes can't write the same files).
+    """
+    # only `max_concurrency` workers exist whatever the size of the file, the file is read
+    # lazily: reading waits when the queue is full and `READ_AHEAD_SIZE` urls of busy hosts
+    # are put aside
+    scheduler = FetchScheduler(
+        max_size=args.max_concurrency * QUEUE_MAX_SIZE_COEFFICIENT,
+        per_host_limit=args.per_host_limit,
+        per_host_max_size=args.per_host_limit * QUEUE_MAX_SIZE_COEFFICIENT,
+        read_ahead_size=READ_AHEAD_SIZE,
+    )
 
+    cache = None
+    if not args.no_cache:
+        cache = CacheIndex.load(Path(OUTPUT_DIR, CACHE_INDEX_FILE_NAME))
 
-async def main():
-    args = parser.parse_args()
+    storage = make_storage(args, shard)
+
+    connector_config = ConnectorConfig(
+        pool_size=args.pool_size or args.max_concurrency,
+        limit_per_host=args.per_host_limit,
+        dns_cache_ttl=args.dns_cache_ttl,
+        keepalive_timeout=args.keepalive_timeout,
+        happy_eyeballs_delay=args.happy_eyeballs_delay or None,
+        resolve_overrides=args.resolve_overrides,
+    )
 
-    tasks = []
+    metrics_log = args.metrics_log
+    if metrics_log and shard is not None:
+        metrics_log = f"{metrics_log}.{shard}"
+    metrics = MetricsCollector(log_file_path=metrics_log)
+    monitoring_task = asyncio.create_task(
+        metrics_monitoring(
+            metrics,
+            args.metrics_interval,
+            prefix="" if shard is None else f"Process #{shard + 1}: ",
+        )
+    )
+
+    async with aiohttp.ClientSession(
+        connector=make_connector(connector_config), trace_configs=[make_trace_config()]
+    ) as session:
+        context = FetchContext(
+            session=session,
+            stream=args.stream,
+            chunk_size=args.chunk_size,
+            cache=cache,
+            storage=storage,
+            retry_policy=RetryPolicy(
+                retries=args.retries, backoff_base=args.backoff_base, backoff_max=BACKOFF_MAX
+            ),
+            breakers=CircuitBreakers(
+                failure_threshold=args.breaker_threshold,
+                reset_timeout=args.breaker_reset_timeout,
+            ),
+            metrics=metrics,
+        )
+        workers = [
+            asyncio.create_task(fetch_worker(context, scheduler))
+            for _ in range(args.max_concurrency)
+        ]
 
-    async with aiohttp.ClientSession() as session:
         async for line in read_lines(args.filepath):
             url = line.strip()
-            task = asyncio.create_task(process_url(session, url))
-            tasks.append(task)
+            if not url:
+                continue
+            if shard is not None and get_shard_index(url, args.processes) != shard:
+                continue
+            await scheduler.put(url)
+        await scheduler.close()
+
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            monitoring_task.cancel()
+            metrics.close()
+
+            if shard is None:
+                await storage.close()
+                if cache is not None:
+                    cache.save()
+            else:
+                await storage.flush()
+
+    if shard is None:
+        return CrawlResult(metrics=metrics, cache_updates=None, storage_updates=None)
+    return CrawlResult(
+        metrics=metrics,
+        cache_updates=cache.get_updates() if cache is not None else None,
+        storage_updates=storage.get_updates(),
+    )
+
 
-        await asyncio.wait(tasks)
+def run_crawl_process(args: argparse.Namespace, shard: int) -> CrawlResult:
+    return asyncio.run(crawl(args, shard))
+
+
+async def crawl_by_processes(args: argparse.Namespace) -> MetricsCollector:
+    """
+    One event loop is limited by one core: TLS handshakes, parsing and writing take CPU.
+    Urls are sharded by host between processes, every process has its own event loop
+    and session, and results are merged here.
+    """
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = [
+            loop.run_in_executor(executor, run_crawl_process, args, shard)
+            for shard in range(args.processes)
+        ]
+        results = await asyncio.gather(*futures)
+
+    metrics = MetricsCollector()
+    storage = make_storage(args)
+    cache = None if args.no_cache else CacheIndex.load(Path(OUTPUT_DIR, CACHE_INDEX_FILE_NAME))
+    for result in results:
+        metrics.merge(result.metrics)
+        storage.apply_updates(result.storage_updates)
+        if cache is not None:
+            cache.apply_updates(result.cache_updates)
+
+    await storage.close()
+    if cache is not None:
+        cache.save()
+    return metrics
+
+
+async def main():
+    args = parser.parse_args()
+    validate_args(args)
+
+    if args.processes > 1:
+        metrics = await crawl_by_processes(args)
+    else:
+        metrics = (await crawl(args)).metrics
+    metrics.save_summary(args.metrics_file)
+
+    summary = metrics.get_summary()
+    print(
+        f"Pages: {summary['pages']} ({summary['pages_per_second']:.1f}/s), "
+        f"{summary['bytes_per_second'] / 1024 / 1024:.2f} MB/s"
+    )
+    print("Pages:", ", ".join(f"{key}={value}" for key, value in metrics.outcomes.items()))
+    print(f"Metrics summary is saved to {args.metrics_file}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import time
+
+from array import array
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+
+import aiohttp
+
+from storage import save_json
+
+PHASES = ("queued", "dns", "connect", "ttfb", "total")
+PERCENTILES = (50, 90, 95, 99)
+
+
+@dataclass
+class UrlMetrics:
+    """
+    Metrics of one page. Phases are in seconds and are measured for the last attempt,
+    `total` includes all attempts and delays between them.
+    DNS and connect are None when connection was taken from the pool.
+    """
+
+    url: str
+    outcome: str | None = None
+    status: int | None = None
+    bytes: int = 0
+    retries: int = 0
+    queued: float | None = None
+    dns: float | None = None
+    connect: float | None = None
+    ttfb: float | None = None
+    total: float | None = None
+    started_at: float = field(default_factory=time.perf_counter, repr=False)
+    # start times of phases, they are set by trace callbacks
+    _phase_starts: dict[str, float] = field(default_factory=dict, repr=False)
+
+    def start_phase(self, phase: str) -> None:
+        self._phase_starts[phase] = time.perf_counter()
+
+    def end_phase(self, phase: str) -> None:
+        started_at = self._phase_starts.pop(phase, None)
+        if started_at is not None:
+            setattr(self, phase, time.perf_counter() - started_at)
+
+    def finish(self) -> None:
+        self.total = time.perf_counter() - self.started_at
+
+    def to_dict(self) -> dict:
+        result = asdict(self)
+        result.pop("started_at")
+        result.pop("_phase_starts")
+        return result
+
+
+def _get_url_metrics(trace_config_ctx: SimpleNamespace) -> UrlMetrics | None:
+    # requests without `trace_request_ctx` (for instance, benchmark) are not measured
+    return trace_config_ctx.trace_request_ctx
+
+
+def _on_phase_start(phase: str):
+    async def handler(_, trace_config_ctx: SimpleNamespace, __) -> None:
+        url_metrics = _get_url_metrics(trace_config_ctx)
+        if url_metrics is not None:
+            url_metrics.start_phase(phase)
+
+    return handler
+
+
+def _on_phase_end(phase: str):
+    async def handler(_, trace_config_ctx: SimpleNamespace, __) -> None:
+        url_metrics = _get_url_metrics(trace_config_ctx)
+        if url_metrics is not None:
+            url_metrics.end_phase(phase)
+
+    return handler
+
+
+def make_trace_config() -> aiohttp.TraceConfig:
+    """
+    UrlMetrics object must be passed to request as `trace_request_ctx`.
+    TTFB is time from request start to received response headers.
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_phase_start("ttfb"))
+    trace_config.on_request_end.append(_on_phase_end("ttfb"))
+    trace_config.on_connection_queued_start.append(_on_phase_start("queued"))
+    trace_config.on_connection_queued_end.append(_on_phase_end("queued"))
+    trace_config.on_dns_resolvehost_start.append(_on_phase_start("dns"))
+    trace_config.on_dns_resolvehost_end.append(_on_phase_end("dns"))
+    trace_config.on_connection_create_start.append(_on_phase_start("connect"))
+    trace_config.on_connection_create_end.append(_on_phase_end("connect"))
+    return trace_config
+
+
+def get_percentiles(values: list[float] | array) -> dict[str, float]:
+    if not values:
+        return {}
+    sorted_values = sorted(values)
+    last_index = len(sorted_values) - 1
+    return {
+        f"p{percentile}": sorted_values[round(last_index * percentile / 100)]
+        for percentile in PERCENTILES
+    }
+
+
+class MetricsCollector:
+    """
+    Aggregates metrics of pages. Only numbers are kept (not UrlMetrics objects), so memory
+    is ~8 bytes per page per phase. Every page can be written as a json line to the log file.
+    """
+
+    def __init__(self, log_file_path: str | Path | None = None) -> None:
+        self.started_at = time.time()
+        self.finished_at: float | None = None
+        self.pages = 0
+        self.bytes = 0
+        self.retries = 0
+        self.outcomes: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.phases: dict[str, array] = {phase: array("d") for phase in PHASES}
+
+        self._log_file = open(log_file_path, "w") if log_file_path else None
+        # numbers of the last live report
+        self._reported_pages = 0
+        self._reported_bytes = 0
+        self._reported_at = time.perf_counter()
+
+    def record(self, url_metrics: UrlMetrics) -> None:
+        url_metrics.finish()
+
+        self.pages += 1
+        self.bytes += url_metrics.bytes
+        self.retries += url_metrics.retries
+        self.outcomes[url_metrics.outcome] += 1
+        if url_metrics.status is not None:
+            self.statuses[str(url_metrics.status)] += 1
+        for phase in PHASES:
+            value = getattr(url_metrics, phase)
+            if value is not None:
+                self.phases[phase].append(value)
+
+        if self._log_file is not None:
+            self._log_file.write(json.dumps(url_metrics.to_dict()) + "\n")
+
+    def merge(self, other: "MetricsCollector") -> None:
+        self.started_at = min(self.started_at, other.started_at)
+        if other.finished_at is not None:
+            self.finished_at = max(self.finished_at or 0, other.finished_at)
+        self.pages += other.pages
+        self.bytes += other.bytes
+        self.retries += other.retries
+        self.outcomes.update(other.outcomes)
+        self.statuses.update(other.statuses)
+        for phase in PHASES:
+            self.phases[phase].extend(other.phases[phase])
+
+    def close(self) -> None:
+        self.finished_at = time.time()
+        if self._log_file is not None:
+            self._log_file.close()
+            self._log_file = None
+
+    def __getstate__(self) -> dict:
+        # collector is sent between processes, log file is not needed there
+        state = self.__dict__.copy()
+        state["_log_file"] = None
+        return state
+
+    def get_live_report(self) -> str:
+        """
+        Throughput and latency since the previous report.
+        """
+        now = time.perf_counter()
+        interval = now - self._reported_at
+        pages = self.pages - self._reported_pages
+        latencies = get_percentiles(self.phases["total"][self._reported_pages:])
+
+        report = (
+            f"Pages: {self.pages} ({pages / interval:.1f}/s), "
+            f"{(self.bytes - self._reported_bytes) / interval / 1024 / 1024:.2f} MB/s"
+        )
+        if latencies:
+            report += ", latency " + " ".join(
+                f"{key}={value * 1000:.0f}ms" for key, value in latencies.items()
+            )
+
+        self._reported_pages = self.pages
+        self._reported_bytes = self.bytes
+        self._reported_at = now
+        return report
+
+    def get_summary(self) -> dict:
+        duration = (self.finished_at or time.time()) - self.started_at
+        return {
+            "pages": self.pages,
+            "bytes": self.bytes,
+            "retries": self.retries,
+            "duration_seconds": duration,
+            "pages_per_second": self.pages / duration if duration else 0,
+            "bytes_per_second": self.bytes / duration if duration else 0,
+            "outcomes": dict(self.outcomes),
+            "statuses": dict(self.statuses),
+            "latency_seconds": {
+                phase: get_percentiles(values) for phase, values in self.phases.items()
+            },
+        }
+
+    def save_summary(self, file_path: str | Path) -> None:
+        save_json(file_path, self.get_summary(), indent=4)
+
+
+async def metrics_monitoring(
+    metrics: MetricsCollector, interval: float, prefix: str = ""
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        print(f"{prefix}{metrics.get_live_report()}")
@@ -0,0 +1,114 @@
+import enum
+import random
+import time
+
+from http import HTTPStatus
+from typing import NamedTuple
+
+import aiohttp
+
+RETRYABLE_STATUSES = frozenset(
+    {
+        HTTPStatus.REQUEST_TIMEOUT,
+        HTTPStatus.TOO_EARLY,
+        HTTPStatus.TOO_MANY_REQUESTS,
+        HTTPStatus.INTERNAL_SERVER_ERROR,
+        HTTPStatus.BAD_GATEWAY,
+        HTTPStatus.SERVICE_UNAVAILABLE,
+        HTTPStatus.GATEWAY_TIMEOUT,
+    }
+)
+# Connection errors include refused connections, DNS errors and server disconnects.
+# Other client errors (invalid url, too many redirects, etc.) won't be fixed by retry.
+RETRYABLE_EXCEPTIONS = (
+    TimeoutError,
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+)
+
+
+class RetryPolicy(NamedTuple):
+    retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 10
+
+    def get_delay(self, attempt: int) -> float:
+        """
+        Exponential backoff with "full jitter": random delay between 0 and base * 2^attempt.
+        Jitter is important, without it all failed requests of one host are retried
+        at the same moment and the host is hammered again.
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+class CircuitState(enum.Enum):
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+
+class CircuitBreaker:
+    """
+    Breaker is opened after `failure_threshold` failures in a row, and all requests to
+    the host are rejected immediately, so a dead host doesn't take concurrency slots.
+    After `reset_timeout` seconds it's half-opened: only one request (probe) is sent,
+    other requests are rejected until its result, success closes the breaker,
+    failure opens it again. A probe which ended without a result (for instance, it was cancelled)
+    doesn't block the host forever, the next probe is allowed after `reset_timeout`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probe_started_at: float | None = None
+
+    @property
+    def state(self) -> CircuitState:
+        if self._opened_at is None:
+            return CircuitState.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return CircuitState.HALF_OPEN
+        return CircuitState.OPEN
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.OPEN:
+            return False
+
+        now = time.monotonic()
+        if (
+            self._probe_started_at is not None
+            and now - self._probe_started_at < self.reset_timeout
+        ):
+            return False
+        self._probe_started_at = now
+        return True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started_at = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_started_at = None
+        if self.state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+class CircuitBreakers:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            self._breakers[host] = breaker
+        return breaker
@@ -0,0 +1,150 @@
+import asyncio
+import zlib
+from collections import deque
+from urllib.parse import urlsplit
+
+
+def get_host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def get_shard_index(url: str, shards_number: int) -> int:
+    """
+    All urls of one host are in the same shard, so per-host limits are correct
+    when shards are processed by different processes.
+    crc32 is used because built-in `hash` of str is different in every process.
+    """
+    return zlib.crc32(get_host(url).encode()) % shards_number
+
+
+class FetchScheduler:
+    """
+    Bounded queue of urls grouped by host.
+
+    Producer puts urls lazily, workers get urls in round-robin order across hosts.
+    A host is given to a worker only when it has less than `per_host_limit` active
+    requests, so one big host can't take all connections and other hosts are not waiting for it.
+    The global concurrency cap is the number of workers that call `get`.
+
+    One host can have at most `per_host_max_size` queued urls, so a long run of urls
+    of one host doesn't fill the queue. Urls which can't be queued (the host has enough
+    queued urls or the queue is full) are put aside and the producer reads on,
+    they are queued when there is room. Producer waits only when `read_ahead_size` urls
+    are put aside, so a run of one host longer than that still lowers concurrency.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        per_host_limit: int,
+        per_host_max_size: int | None = None,
+        read_ahead_size: int = 0,
+    ) -> None:
+        self._max_size = max_size
+        self._per_host_limit = per_host_limit
+        self._per_host_max_size = per_host_max_size or max_size
+        self._read_ahead_size = read_ahead_size
+        self._pending: dict[str, deque[str]] = {}
+        # urls put aside by host, in order of hosts
+        self._deferred: dict[str, deque[str]] = {}
+        self._deferred_size = 0
+        self._active: dict[str, int] = {}
+        # hosts which have pending urls and free slots, in round-robin order
+        self._ready_hosts: deque[str] = deque()
+        self._ready_hosts_set: set[str] = set()
+        self._size = 0
+        self._closed = False
+        self._condition = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return self._size
+
+    async def put(self, url: str) -> None:
+        host = get_host(url)
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self._can_enqueue(host) or self._deferred_size < self._read_ahead_size
+            )
+
+            if self._can_enqueue(host):
+                self._enqueue(host, url)
+            else:
+                self._deferred.setdefault(host, deque()).append(url)
+                self._deferred_size += 1
+            self._condition.notify_all()
+
+    def _can_enqueue(self, host: str) -> bool:
+        # urls of the host which are put aside go first
+        return (
+            host not in self._deferred
+            and self._size < self._max_size
+            and len(self._pending.get(host, ())) < self._per_host_max_size
+        )
+
+    def _enqueue(self, host: str, url: str) -> None:
+        self._pending.setdefault(host, deque()).append(url)
+        self._size += 1
+        self._mark_ready(host)
+
+    def _enqueue_deferred(self) -> None:
+        for host in list(self._deferred):
+            if self._size >= self._max_size:
+                break
+            host_urls = self._deferred[host]
+            while host_urls and len(self._pending.get(host, ())) < self._per_host_max_size:
+                if self._size >= self._max_size:
+                    break
+                self._enqueue(host, host_urls.popleft())
+                self._deferred_size -= 1
+            if not host_urls:
+                del self._deferred[host]
+
+    async def close(self) -> None:
+        """
+        Nothing will be put anymore. Workers get None when the queue is empty.
+        """
+        async with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    async def get(self) -> str | None:
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self._ready_hosts
+                or (self._closed and not self._size and not self._deferred_size)
+            )
+            if not self._ready_hosts:
+                return None
+
+            host = self._ready_hosts.popleft()
+            self._ready_hosts_set.discard(host)
+
+            host_urls = self._pending[host]
+            url = host_urls.popleft()
+            if not host_urls:
+                del self._pending[host]
+            self._size -= 1
+            self._active[host] = self._active.get(host, 0) + 1
+            self._enqueue_deferred()
+
+            # host goes to the end of the line, so other hosts are served first
+            self._mark_ready(host)
+            self._condition.notify_all()
+            return url
+
+    async def task_done(self, url: str) -> None:
+        host = get_host(url)
+        async with self._condition:
+            self._active[host] -= 1
+            if not self._active[host]:
+                del self._active[host]
+            self._mark_ready(host)
+            self._condition.notify_all()
+
+    def _mark_ready(self, host: str) -> None:
+        if host in self._ready_hosts_set or host not in self._pending:
+            return
+        if self._active.get(host, 0) >= self._per_host_limit:
+            return
+        self._ready_hosts.append(host)
+        self._ready_hosts_set.add(host)
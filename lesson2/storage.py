@@ -0,0 +1,214 @@
+import asyncio
+import gzip
+import json
+import os
+import re
+
+from pathlib import Path
+from typing import NamedTuple
+
+import aiofiles
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PACK_FILE_NAME = "pages.pack"
+MANIFEST_FILE_NAME = "pages.manifest.json"
+# Blobs are collected in memory and written to the pack file by big sequential writes
+DEFAULT_FLUSH_SIZE = 4 * 1024 * 1024
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+
+def is_compression_available(compression: str) -> bool:
+    return compression != "zstd" or zstandard is not None
+
+
+def compute_file_name_from_url(url) -> str:
+    result = re.sub(r"[^\w.]", "_", url)
+    return result.strip("_")
+
+
+async def write_file(file_path: str | Path, page_content: bytes) -> None:
+    async with aiofiles.open(file_path, "wb") as file_:
+        await file_.write(page_content)
+
+
+def save_json(file_path: str | Path, data, indent: int | None = None) -> None:
+    """
+    Writes to a temporary file and renames it, so the file is never half-written.
+    """
+    file_path = Path(file_path)
+    tmp_file_path = file_path.with_name(f"{file_path.name}.part")
+    with open(tmp_file_path, "w") as file_:
+        json.dump(data, file_, indent=indent)
+    os.replace(tmp_file_path, file_path)
+
+
+class FileStorage:
+    """
+    Every page is a separate html file, file name is computed from url.
+    """
+
+    def __init__(self, output_dir: str | Path) -> None:
+        self.output_dir = Path(output_dir)
+
+    def get_file_path(self, url: str) -> Path:
+        return Path(self.output_dir, f"{compute_file_name_from_url(url)}.html")
+
+    def exists(self, url: str) -> bool:
+        return self.get_file_path(url).exists()
+
+    async def save(self, url: str, content: bytes, content_hash: str) -> None:
+        await write_file(self.get_file_path(url), content)
+
+    async def flush(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def get_updates(self) -> None:
+        # files are already in the output dir, nothing to merge
+        return None
+
+    def apply_updates(self, updates: None) -> None:
+        pass
+
+
+class BlobLocation(NamedTuple):
+    offset: int
+    size: int
+    compression: str
+    pack_file_name: str = PACK_FILE_NAME
+
+
+class BlobStorageUpdates(NamedTuple):
+    pages: dict[str, str]
+    blobs: dict[str, BlobLocation]
+
+
+def compress(content: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        # mtime=0, otherwise the same page is compressed to different bytes
+        return gzip.compress(content, compresslevel=6, mtime=0)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(content)
+    return content
+
+
+def decompress(content: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.decompress(content)
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress(content)
+    return content
+
+
+class BlobStorage:
+    """
+    Content-addressed storage: page content is stored once per content hash, so mirrors and
+    the same pages under different urls don't take space. Blobs (optionally compressed) are
+    appended to one pack file instead of creating a file per page, manifest keeps
+    url -> content hash and content hash -> blob location in the pack file.
+    """
+
+    def __init__(
+        self,
+        output_dir: str | Path,
+        compression: str = "none",
+        flush_size: int = DEFAULT_FLUSH_SIZE,
+        pack_file_name: str = PACK_FILE_NAME,
+    ) -> None:
+        """
+        Several processes can't append to the same pack file, every process must
+        have its own `pack_file_name`. Manifest is saved only by the main process,
+        see `get_updates` and `apply_updates`.
+        """
+        if not is_compression_available(compression):
+            raise RuntimeError("zstd compression requires `zstandard` package to be installed")
+
+        self.output_dir = Path(output_dir)
+        self.compression = compression
+        self.flush_size = flush_size
+        self.pack_file_name = pack_file_name
+        self.pack_file_path = Path(self.output_dir, pack_file_name)
+        self.manifest_file_path = Path(self.output_dir, MANIFEST_FILE_NAME)
+
+        self._pages: dict[str, str] = {}
+        self._blobs: dict[str, BlobLocation] = {}
+        self._load_manifest()
+        self._updated_pages: dict[str, str] = {}
+        self._new_blobs: dict[str, BlobLocation] = {}
+
+        # Pack size including not flushed buffer, it's the offset of the next blob.
+        # Bytes after the last saved manifest (if the previous run was killed) are not used.
+        self._pack_size = os.path.getsize(self.pack_file_path) if self.pack_file_path.exists() else 0
+        self._buffer = bytearray()
+        self._write_lock = asyncio.Lock()
+
+    def _load_manifest(self) -> None:
+        try:
+            with open(self.manifest_file_path, "r") as file_:
+                manifest = json.load(file_)
+        except FileNotFoundError:
+            return
+        self._pages = manifest["pages"]
+        self._blobs = {key: BlobLocation(*value) for key, value in manifest["blobs"].items()}
+
+    def _save_manifest(self) -> None:
+        save_json(
+            self.manifest_file_path,
+            {
+                "pages": self._pages,
+                "blobs": {key: list(value) for key, value in self._blobs.items()},
+            },
+        )
+
+    def exists(self, url: str) -> bool:
+        return url in self._pages
+
+    async def save(self, url: str, content: bytes, content_hash: str) -> None:
+        self._pages[url] = content_hash
+        self._updated_pages[url] = content_hash
+        if content_hash in self._blobs:
+            return
+
+        blob = compress(content, self.compression)
+        location = BlobLocation(self._pack_size, len(blob), self.compression, self.pack_file_name)
+        self._blobs[content_hash] = location
+        self._new_blobs[content_hash] = location
+        self._pack_size += len(blob)
+        self._buffer += blob
+
+        if len(self._buffer) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        # Buffer is taken before waiting the lock, lock is fair, so writes are done
+        # in the same order as offsets were given
+        buffer, self._buffer = self._buffer, bytearray()
+        async with self._write_lock:
+            if buffer:
+                async with aiofiles.open(self.pack_file_path, "ab") as file_:
+                    await file_.write(buffer)
+
+    async def close(self) -> None:
+        await self.flush()
+        self._save_manifest()
+
+    def get_updates(self) -> BlobStorageUpdates:
+        return BlobStorageUpdates(pages=self._updated_pages, blobs=self._new_blobs)
+
+    def apply_updates(self, updates: BlobStorageUpdates) -> None:
+        self._pages.update(updates.pages)
+        for content_hash, location in updates.blobs.items():
+            # the same content could be stored by two processes, one copy is enough
+            self._blobs.setdefault(content_hash, location)
+
+    def read(self, url: str) -> bytes:
+        location = self._blobs[self._pages[url]]
+        with open(Path(self.output_dir, location.pack_file_name), "rb") as file_:
+            file_.seek(location.offset)
+            return decompress(file_.read(location.size), location.compression)
@@ -0,0 +1,288 @@
+import asyncio
+import enum
+import time
+from collections import deque
+from typing import NamedTuple
+
+from protocol import FIXED_LAYOUT_ENCODINGS, encode_data, encode_ping
+
+DEFAULT_QUEUE_SIZE = 8
+# seconds to flush not sent data of a client at shutdown, then its connection is aborted
+CLOSE_TIMEOUT = 2
+DEFAULT_LOCATION = "Lviv"
+# fields which are sent even when client subscribed to other fields only
+REQUIRED_FIELDS = ("location", "observation_time", "seq", "sent_at")
+
+Address = tuple[str, int]
+
+
+class Topic(NamedTuple):
+    location: str
+    # None means all fields
+    fields: tuple[str, ...] | None = None
+
+    def project(self, data: dict) -> dict:
+        if self.fields is None:
+            return data
+        return {key: value for key, value in data.items() if key in self.fields}
+
+
+DEFAULT_TOPICS = frozenset({Topic(DEFAULT_LOCATION)})
+
+
+def make_topics(locations: list[str], fields: list[str] | None = None) -> frozenset[Topic]:
+    """
+    Fields are sorted, so clients which subscribed to the same fields in a different order
+    share one topic and one serialized message.
+    """
+    if fields is not None:
+        fields = tuple(sorted(set(fields).union(REQUIRED_FIELDS)))
+    return frozenset(Topic(location, fields) for location in locations or [DEFAULT_LOCATION])
+
+
+class SlowConsumerPolicy(enum.Enum):
+    # the oldest not sent message is dropped when the queue is full
+    DROP_OLDEST = "drop_oldest"
+    # client is disconnected when the queue is full
+    DISCONNECT = "disconnect"
+    # only the latest message is kept while client is slow
+    COALESCE = "coalesce"
+
+
+class ClientConnection:
+    """
+    Messages are written to the transport directly while its buffer is not full, so the
+    writer task is not woken up for every message. When the client doesn't read fast enough
+    (transport buffer reached the high-water mark), messages are put into a bounded queue,
+    the writer task waits `drain` and writes them. When the queue is full, the policy is applied.
+    So memory of a client is bounded by the transport high-water mark + `queue_size` messages,
+    even if the peer is dead and nothing is read, until the client is reaped by heartbeats.
+    """
+
+    def __init__(
+        self,
+        addr: Address,
+        writer: asyncio.StreamWriter,
+        encoding: str,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        policy: SlowConsumerPolicy = SlowConsumerPolicy.DROP_OLDEST,
+    ) -> None:
+        self.addr = addr
+        self.writer = writer
+        self.encoding = encoding
+        self.policy = policy
+        self.queue_size = 1 if policy == SlowConsumerPolicy.COALESCE else queue_size
+        self.dropped_messages = 0
+        self.closed = False
+        self.topics: frozenset[Topic] = frozenset()
+        # any frame from the client (including PONG) means that it's alive
+        self.last_received_at = time.monotonic()
+
+        self._queue: deque[bytes] = deque()
+        self._has_queued_data = asyncio.Event()
+        self._writer_task = asyncio.create_task(self._write_queued_data())
+        _, self._high_water = writer.transport.get_write_buffer_limits()
+
+    def _is_transport_full(self) -> bool:
+        return self.writer.transport.get_write_buffer_size() >= self._high_water
+
+    def send(self, data: bytes) -> bool:
+        """
+        Returns False when client must be disconnected.
+        """
+        if self.closed:
+            return False
+
+        if not self._queue and not self._is_transport_full():
+            self.writer.write(data)
+            return True
+
+        if len(self._queue) >= self.queue_size:
+            if self.policy == SlowConsumerPolicy.DISCONNECT:
+                return False
+            # drop oldest and coalesce work the same way, coalesce queue size is 1
+            self._queue.popleft()
+            self.dropped_messages += 1
+
+        self._queue.append(data)
+        self._has_queued_data.set()
+        return True
+
+    async def _write_queued_data(self) -> None:
+        try:
+            while True:
+                await self._has_queued_data.wait()
+                self._has_queued_data.clear()
+
+                while self._queue:
+                    await self.writer.drain()
+                    # queue could be cleared by policy while waiting for drain
+                    if self._queue:
+                        self.writer.write(self._queue.popleft())
+        except ConnectionError:
+            # connection is closed, reading side of the server unregisters the client
+            self.closed = True
+
+    async def close(self, force: bool = False, timeout: float | None = None) -> None:
+        """
+        `force` drops not sent data, it's used for slow and dead clients.
+        Graceful close waits until data is sent, a client which doesn't read never gets it,
+        so its connection is aborted after `timeout` seconds.
+        """
+        self.closed = True
+        self._writer_task.cancel()
+        if force:
+            self.writer.transport.abort()
+        else:
+            self.writer.close()
+        try:
+            async with asyncio.timeout(timeout):
+                await self.writer.wait_closed()
+        except TimeoutError:
+            self.writer.transport.abort()
+        except ConnectionError:
+            pass
+
+
+class Broadcaster:
+    """
+    Keeps subscription index topic -> clients, so a tick costs O(active topics + deliveries)
+    and doesn't depend on the number of known locations.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        policy: SlowConsumerPolicy = SlowConsumerPolicy.DROP_OLDEST,
+    ) -> None:
+        self.queue_size = queue_size
+        self.policy = policy
+        self.clients: dict[Address, ClientConnection] = {}
+        self.subscribers: dict[Topic, set[ClientConnection]] = {}
+        # closing tasks of disconnected slow clients, reference is kept until they are done
+        self._closing_tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def register(
+        self,
+        addr: Address,
+        writer: asyncio.StreamWriter,
+        encoding: str,
+        topics: frozenset[Topic] = DEFAULT_TOPICS,
+    ) -> ClientConnection:
+        client = ClientConnection(addr, writer, encoding, self.queue_size, self.policy)
+        self.clients[addr] = client
+        self._set_topics(client, topics)
+        print(f"Client {addr} was registered, encoding: {encoding}")
+        return client
+
+    def unregister(self, addr: Address) -> ClientConnection | None:
+        client = self.clients.pop(addr, None)
+        if client is not None:
+            self._set_topics(client, frozenset())
+            print(f"Client {addr} was unregistered")
+        return client
+
+    def subscribe(self, addr: Address, topics: frozenset[Topic]) -> None:
+        """
+        Replaces previous subscriptions of the client.
+        """
+        client = self.clients.get(addr)
+        if client is not None:
+            self._set_topics(client, topics)
+
+    def _set_topics(self, client: ClientConnection, topics: frozenset[Topic]) -> None:
+        for topic in client.topics - topics:
+            topic_subscribers = self.subscribers[topic]
+            topic_subscribers.discard(client)
+            if not topic_subscribers:
+                del self.subscribers[topic]
+        for topic in topics - client.topics:
+            self.subscribers.setdefault(topic, set()).add(client)
+        client.topics = topics
+
+    def get_active_locations(self) -> set[str]:
+        """
+        Locations with at least one subscriber, data is generated only for them.
+        """
+        return {topic.location for topic in self.subscribers}
+
+    def broadcast(self, readings: dict[str, dict]) -> int:
+        """
+        `readings` is location -> data. Data is serialized once per topic and encoding,
+        the same bytes object is sent to every subscriber. Fixed layout encodings ignore
+        fields, so they are serialized once per location.
+        Returns number of sent messages.
+        """
+        frames: dict[tuple[Topic, str], bytes] = {}
+        slow_clients = set()
+        failed_clients = set()
+        sent_messages = 0
+        for topic, topic_subscribers in self.subscribers.items():
+            data = readings.get(topic.location)
+            if data is None:
+                continue
+            all_fields_topic = Topic(topic.location)
+            for client in topic_subscribers:
+                if client.encoding in FIXED_LAYOUT_ENCODINGS:
+                    key = (all_fields_topic, client.encoding)
+                else:
+                    key = (topic, client.encoding)
+                frame = frames.get(key)
+                if frame is None:
+                    frame = frames[key] = encode_data(key[0].project(data), client.encoding)
+                try:
+                    sent = client.send(frame)
+                except Exception as e:
+                    # one broken client must not stop broadcasting to others
+                    print(f"Client {client.addr} can't be sent data: {e!r}")
+                    failed_clients.add(client)
+                    continue
+                if sent:
+                    sent_messages += 1
+                else:
+                    slow_clients.add(client)
+
+        for client in slow_clients - failed_clients:
+            print(f"Client {client.addr} is too slow and is disconnected")
+            self.disconnect(client.addr, force=True)
+        for client in failed_clients:
+            self.disconnect(client.addr, force=True)
+        return sent_messages
+
+    def check_heartbeats(self, heartbeat_interval: float, idle_timeout: float) -> None:
+        """
+        Clients which sent nothing during `heartbeat_interval` get PING. Clients which sent
+        nothing during `idle_timeout` are dead (half-open connections are not noticed by TCP
+        for hours), their transports are aborted, so not sent data is dropped.
+        """
+        now = time.monotonic()
+        ping = encode_ping()
+        dead_clients = []
+        for client in self.clients.values():
+            idle_time = now - client.last_received_at
+            if idle_time >= idle_timeout:
+                dead_clients.append(client)
+            elif idle_time >= heartbeat_interval and not client.send(ping):
+                dead_clients.append(client)
+
+        for client in dead_clients:
+            print(f"Client {client.addr} doesn't respond and is disconnected")
+            self.disconnect(client.addr, force=True)
+
+    def disconnect(self, addr: Address, force: bool = False) -> None:
+        client = self.unregister(addr)
+        if client is None:
+            return
+        task = asyncio.create_task(client.close(force=force))
+        self._closing_tasks.add(task)
+        task.add_done_callback(self._closing_tasks.discard)
+
+    async def close(self) -> None:
+        clients = list(self.clients.values())
+        for client in clients:
+            self.unregister(client.addr)
+        await asyncio.gather(*[client.close(timeout=CLOSE_TIMEOUT) for client in clients])
+        await asyncio.gather(*self._closing_tasks)
@@ -0,0 +1,115 @@
+"""
+Non-blocking message channel over a pipe between the generator and worker processes.
+
+Messages are written from the event loop: what doesn't fit into the pipe is kept in a bounded
+queue and written when the pipe becomes writable, the oldest messages are dropped when
+the queue is full. So a stalled peer never blocks the event loop (and other workers),
+it only loses old ticks. Messages are read as soon as their bytes arrive, a partially
+received message doesn't block either.
+"""
+import asyncio
+import os
+import struct
+from collections import deque
+from collections.abc import Callable
+from multiprocessing.connection import Connection
+
+# length of the message
+HEADER = struct.Struct("!I")
+DEFAULT_QUEUE_SIZE = 8
+READ_SIZE = 256 * 1024
+
+
+class PipeChannel:
+    def __init__(
+        self,
+        connection: Connection,
+        on_message: Callable[[bytes], None],
+        on_close: Callable[[], None],
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ) -> None:
+        self.connection = connection
+        self.queue_size = queue_size
+        self.dropped_messages = 0
+        self.closed = False
+        self._on_message = on_message
+        self._on_close = on_close
+        self._fd = connection.fileno()
+        self._loop = asyncio.get_running_loop()
+        self._queue: deque[bytes] = deque()
+        # the rest of the message which is written partially, it's never dropped
+        self._writing: memoryview | None = None
+        self._writer_added = False
+        self._read_buffer = bytearray()
+
+        os.set_blocking(self._fd, False)
+        self._loop.add_reader(self._fd, self._read)
+
+    def send(self, payload: bytes) -> None:
+        if self.closed:
+            return
+        if len(self._queue) >= self.queue_size:
+            self._queue.popleft()
+            self.dropped_messages += 1
+        self._queue.append(HEADER.pack(len(payload)) + payload)
+        self._write()
+
+    def _write(self) -> None:
+        while self._writing is not None or self._queue:
+            if self._writing is None:
+                self._writing = memoryview(self._queue.popleft())
+            try:
+                written = os.write(self._fd, self._writing)
+            except BlockingIOError:
+                break
+            except OSError:
+                self.close()
+                return
+            self._writing = self._writing[written:] if written < len(self._writing) else None
+
+        has_data = self._writing is not None or bool(self._queue)
+        if has_data and not self._writer_added:
+            self._loop.add_writer(self._fd, self._write)
+            self._writer_added = True
+        elif not has_data and self._writer_added:
+            self._loop.remove_writer(self._fd)
+            self._writer_added = False
+
+    def _read(self) -> None:
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.close()
+            return
+
+        self._read_buffer += data
+        position = 0
+        while len(self._read_buffer) - position >= HEADER.size:
+            (length,) = HEADER.unpack_from(self._read_buffer, position)
+            message_end = position + HEADER.size + length
+            if len(self._read_buffer) < message_end:
+                break
+            message = bytes(self._read_buffer[position + HEADER.size:message_end])
+            position = message_end
+            self._on_message(message)
+            if self.closed:
+                return
+        del self._read_buffer[:position]
+
+    def close(self) -> None:
+        """
+        Stops reading and writing, the connection itself is closed by its owner.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._loop.remove_reader(self._fd)
+        if self._writer_added:
+            self._loop.remove_writer(self._fd)
+        self._queue.clear()
+        self._writing = None
+        self._on_close()
@@ -1,9 +1,69 @@
 import asyncio
 import argparse
 
+from protocol import (
+    PROTOCOL_VERSION,
+    SUPPORTED_ENCODINGS,
+    MessageType,
+    ProtocolError,
+    decode_data,
+    decode_welcome,
+    encode_hello,
+    encode_pong,
+    encode_subscribe,
+    read_frame,
+)
+
 parser = argparse.ArgumentParser(description="Weather cient.")
 parser.add_argument('--host', type=str, default="localhost")
 parser.add_argument('--port', type=str, default=8000)
+parser.add_argument(
+    '--encodings',
+    type=str,
+    default=",".join(SUPPORTED_ENCODINGS),
+    help="Encodings which are offered to the server, in preferred order.",
+)
+parser.add_argument(
+    '--locations',
+    type=str,
+    default="",
+    help="Comma separated locations to subscribe to, server chooses the default one when empty.",
+)
+parser.add_argument(
+    '--fields',
+    type=str,
+    default="",
+    help="Comma separated fields to receive, all fields when empty. Ignored by struct encoding.",
+)
+
+
+def split_names(value: str) -> list[str]:
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+async def handshake(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, encodings: list[str]
+) -> str:
+    """
+    Returns encoding chosen by the server.
+    """
+    writer.write(encode_hello(encodings))
+    await writer.drain()
+
+    frame = await read_frame(reader)
+    if frame is None:
+        raise ProtocolError("Server closed the connection during handshake")
+
+    message_type, payload = frame
+    if message_type == MessageType.ERROR:
+        raise ProtocolError(payload.decode())
+    if message_type != MessageType.WELCOME:
+        raise ProtocolError(f"WELCOME expected, {message_type.name} received")
+
+    version, encoding = decode_welcome(payload)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    return encoding
 
 
 async def tcp_echo_client():
@@ -14,17 +74,39 @@ async def tcp_echo_client():
 
     counter = 0
     try:
+        encoding = await handshake(reader, writer, args.encodings.split(","))
+        print(f"Encoding: {encoding}")
+
+        if args.locations or args.fields:
+            writer.write(
+                encode_subscribe(split_names(args.locations), split_names(args.fields) or None)
+            )
+            await writer.drain()
 
         while True:
-            encoded_data = await reader.read(2048)
-            # if data is empty it means that server closed connection
-            if not encoded_data:
+            frame = await read_frame(reader)
+            # if frame is None it means that server closed connection
+            if frame is None:
                 print("Server closed the connection.")
                 break
-            decoded_data = encoded_data.decode()
+
+            message_type, payload = frame
+            if message_type == MessageType.PING:
+                writer.write(encode_pong(payload))
+                continue
+            if message_type == MessageType.ERROR:
+                print(f"Server error: {payload.decode()}")
+                continue
+            if message_type != MessageType.DATA:
+                continue
+            decoded_data = decode_data(payload, encoding)
             counter += 1
-            print(f"{counter}: Weather data received:\n{decoded_data}\n")
+            print(f"{counter}: Weather data received ({len(payload)} bytes):\n{decoded_data}\n")
 
+    except ProtocolError as e:
+        print(f"Protocol error: {e}")
+        writer.close()
+        await writer.wait_closed()
     except (asyncio.CancelledError, KeyboardInterrupt):
         print('Connection is being closed.')
         writer.close()
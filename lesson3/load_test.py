@@ -0,0 +1,226 @@
+"""
+Load test of the weather server: thousands of connections from one process.
+
+Every message has `seq` (tick number) and `sent_at` (server unix time), so delivery latency,
+lost messages (gaps in seq of a location) and out of order messages are measured per connection.
+Client and server must use the same clock (the same host), otherwise latency is shifted.
+"""
+import asyncio
+import argparse
+import json
+import resource
+import time
+from array import array
+from collections import Counter
+
+from client import handshake, split_names
+from protocol import (
+    SUPPORTED_ENCODINGS,
+    MessageType,
+    ProtocolError,
+    decode_data,
+    encode_pong,
+    encode_subscribe,
+    read_frame,
+)
+
+PERCENTILES = (50, 90, 95, 99)
+# too many simultaneous SYNs overflow the listen backlog of the server
+DEFAULT_CONNECT_CONCURRENCY = 200
+
+parser = argparse.ArgumentParser(description="Weather server load test.")
+parser.add_argument('--host', type=str, default="localhost")
+parser.add_argument('--port', type=str, default=8000)
+parser.add_argument('--connections', type=int, default=1000)
+parser.add_argument(
+    '--duration', type=float, default=30, help="Seconds to receive messages after connecting."
+)
+parser.add_argument(
+    '--encodings',
+    type=str,
+    default=",".join(SUPPORTED_ENCODINGS),
+    help="Encodings which are offered to the server, in preferred order.",
+)
+parser.add_argument(
+    '--locations',
+    type=str,
+    default="",
+    help="Comma separated locations, every connection subscribes to one of them (round-robin). "
+    "Default location of the server is used when empty.",
+)
+parser.add_argument(
+    '--connect-concurrency',
+    type=int,
+    default=DEFAULT_CONNECT_CONCURRENCY,
+    help="How many connections are opened at the same time.",
+)
+parser.add_argument(
+    '--report-interval', type=float, default=5, help="Seconds between live reports."
+)
+parser.add_argument('--summary-file', type=str, default=None, help="Save summary as json.")
+
+
+def get_percentiles(values: array) -> dict[str, float]:
+    if not values:
+        return {}
+    sorted_values = sorted(values)
+    last_index = len(sorted_values) - 1
+    result = {
+        f"p{percentile}": sorted_values[round(last_index * percentile / 100)]
+        for percentile in PERCENTILES
+    }
+    result["max"] = sorted_values[-1]
+    return result
+
+
+def raise_open_files_limit() -> None:
+    # every connection is a file descriptor, default soft limit is often 1024
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class LoadStats:
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.connected = 0
+        self.errors: Counter = Counter()
+        self.messages = 0
+        self.bytes = 0
+        self.lost = 0
+        self.out_of_order = 0
+        self.latencies = array("d")
+
+        self._reported_messages = 0
+        self._reported_at = time.perf_counter()
+
+    def record(self, data: dict, size: int, last_seqs: dict[str, int]) -> None:
+        self.latencies.append(time.time() - data["sent_at"])
+        self.messages += 1
+        self.bytes += size
+
+        # seq is a tick number, so it's continuous in the stream of one location
+        location, seq = data["location"], data["seq"]
+        last_seq = last_seqs.get(location)
+        if last_seq is None or seq > last_seq:
+            if last_seq is not None:
+                self.lost += seq - last_seq - 1
+            last_seqs[location] = seq
+        else:
+            self.out_of_order += 1
+
+    def get_live_report(self) -> str:
+        now = time.perf_counter()
+        messages = self.messages - self._reported_messages
+        latencies = get_percentiles(self.latencies[self._reported_messages:])
+        report = (
+            f"Connections: {self.connected}, messages: {self.messages} "
+            f"({messages / (now - self._reported_at):.1f}/s)"
+        )
+        if latencies:
+            report += ", latency " + " ".join(
+                f"{key}={value * 1000:.1f}ms" for key, value in latencies.items()
+            )
+        self._reported_messages = self.messages
+        self._reported_at = now
+        return report
+
+    def get_summary(self) -> dict:
+        duration = time.perf_counter() - self.started_at
+        return {
+            "connections": self.connected,
+            "errors": dict(self.errors),
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "duration_seconds": duration,
+            "messages_per_second": self.messages / duration if duration else 0,
+            "lost_messages": self.lost,
+            "out_of_order_messages": self.out_of_order,
+            "latency_seconds": get_percentiles(self.latencies),
+        }
+
+
+async def run_connection(
+    args: argparse.Namespace,
+    stats: LoadStats,
+    connect_semaphore: asyncio.Semaphore,
+    location: str | None,
+    deadline: float,
+) -> None:
+    writer = None
+    async with connect_semaphore:
+        # a server which accepts but doesn't answer must not hang the test after the deadline
+        try:
+            async with asyncio.timeout_at(deadline):
+                reader, writer = await asyncio.open_connection(args.host, args.port)
+                encoding = await handshake(reader, writer, split_names(args.encodings))
+                if location is not None:
+                    writer.write(encode_subscribe([location]))
+                    await writer.drain()
+        except (TimeoutError, OSError, ProtocolError) as e:
+            error = "connect_timeout" if isinstance(e, TimeoutError) else type(e).__name__
+            stats.errors[error] += 1
+            if writer is not None:
+                writer.transport.abort()
+            return
+    stats.connected += 1
+
+    last_seqs: dict[str, int] = {}
+    try:
+        async with asyncio.timeout_at(deadline):
+            while (frame := await read_frame(reader)) is not None:
+                message_type, payload = frame
+                if message_type == MessageType.DATA:
+                    stats.record(decode_data(payload, encoding), len(payload), last_seqs)
+                elif message_type == MessageType.PING:
+                    writer.write(encode_pong(payload))
+        # server closed the connection before the end of the test
+        stats.errors["closed_by_server"] += 1
+    except TimeoutError:
+        pass
+    except (OSError, ProtocolError) as e:
+        stats.errors[type(e).__name__] += 1
+    finally:
+        writer.transport.abort()
+
+
+async def live_reports(stats: LoadStats, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        print(stats.get_live_report())
+
+
+async def main():
+    args = parser.parse_args()
+    raise_open_files_limit()
+    locations = split_names(args.locations)
+    print(f"Opening {args.connections} connections to {args.host}:{args.port}")
+
+    stats = LoadStats()
+    connect_semaphore = asyncio.Semaphore(args.connect_concurrency)
+    # the deadline is common, so connections opened later are measured for less time
+    deadline = asyncio.get_running_loop().time() + args.duration
+    reports_task = asyncio.create_task(live_reports(stats, args.report_interval))
+    try:
+        await asyncio.gather(*[
+            run_connection(
+                args,
+                stats,
+                connect_semaphore,
+                locations[index % len(locations)] if locations else None,
+                deadline,
+            )
+            for index in range(args.connections)
+        ])
+    finally:
+        reports_task.cancel()
+
+    summary = stats.get_summary()
+    print(json.dumps(summary, indent=4))
+    if args.summary_file:
+        with open(args.summary_file, "w") as file_:
+            json.dump(summary, file_, indent=4)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,251 @@
+"""
+Weather protocol.
+
+Every message is a frame: 4 bytes payload length + 1 byte message type + payload,
+so a reader always knows where a message ends, whatever the stream returns by one read.
+
+Connection starts with handshake:
+    client -> HELLO: protocol version (1 byte) + encodings supported by client in preferred order
+              (ascii, comma separated)
+    server -> WELCOME: protocol version (1 byte) + chosen encoding (ascii)
+              or ERROR: error message (utf-8), and connection is closed
+After handshake server sends DATA frames with weather data encoded by the chosen encoding.
+
+Client can send SUBSCRIBE at any time: json {"locations": [...], "fields": [...] | null}.
+It replaces previous subscriptions, client which never subscribed receives the default location.
+`fields` are ignored by fixed layout encodings (struct), all fields are sent there.
+Invalid SUBSCRIBE is answered by ERROR, connection is not closed.
+
+Heartbeats (version 2): server sends PING to a client which has sent nothing for a while,
+client must answer PONG with the same payload. Client which sends nothing during the idle
+timeout is considered dead and is disconnected. Any side can send PING.
+"""
+import asyncio
+import enum
+import json
+import struct
+import time
+from datetime import datetime, timezone
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+PROTOCOL_VERSION = 2
+FRAME_HEADER = struct.Struct("!IB")
+# protection from clients which send garbage instead of length
+MAX_FRAME_SIZE = 64 * 1024
+OBSERVATION_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+MAX_SUBSCRIPTIONS = 100
+PING_PAYLOAD = struct.Struct("!d")
+
+
+class MessageType(enum.IntEnum):
+    HELLO = 1
+    WELCOME = 2
+    DATA = 3
+    ERROR = 4
+    SUBSCRIBE = 5
+    PING = 6
+    PONG = 7
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(message_type: MessageType, payload: bytes = b"") -> bytes:
+    return FRAME_HEADER.pack(len(payload), message_type) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[MessageType, bytes] | None:
+    """
+    Returns None when connection is closed.
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        length, message_type = FRAME_HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise ProtocolError(f"Frame is too big: {length} bytes")
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+    try:
+        return MessageType(message_type), payload
+    except ValueError:
+        raise ProtocolError(f"Unknown message type {message_type}")
+
+
+# Struct encoding: numbers have fixed size, strings are replaced by indexes.
+# Location is the only string, it's at the end: 1 byte length + utf-8 bytes.
+# seq (tick number) and sent_at (unix time as double) are at the beginning.
+WEATHER_STRUCT = struct.Struct("!IdbBBBHIBBB")
+WEATHER_CONDITIONS = ("Cloudy", "Sunny", "Sunny/Cloudy", "Rainy", "Snowy")
+WIND_DIRECTIONS = ("N", "NE", "E", "SE", "S", "SW", "W", "NW")
+
+
+def _encode_struct(data: dict) -> bytes:
+    location = data["location"].encode()[:255]
+    # fromisoformat is much faster than strptime, "Z" suffix means UTC
+    observation_time = int(datetime.fromisoformat(data["observation_time"]).timestamp())
+    return WEATHER_STRUCT.pack(
+        data["seq"],
+        data["sent_at"],
+        data["temperature_celsius"],
+        data["humidity_percentage"],
+        data["wind_speed_kph"],
+        data["cloud_coverage_percentage"],
+        data["pressure_hpa"],
+        observation_time,
+        WEATHER_CONDITIONS.index(data["weather_condition"]),
+        WIND_DIRECTIONS.index(data["wind_direction"]),
+        len(location),
+    ) + location
+
+
+def _decode_struct(payload: bytes) -> dict:
+    (
+        seq,
+        sent_at,
+        temperature,
+        humidity,
+        wind_speed,
+        cloud_coverage,
+        pressure,
+        observation_time,
+        weather_condition,
+        wind_direction,
+        location_length,
+    ) = WEATHER_STRUCT.unpack_from(payload)
+    location = payload[WEATHER_STRUCT.size:WEATHER_STRUCT.size + location_length]
+    return {
+        "location": location.decode(),
+        "pressure_hpa": pressure,
+        "observation_time": datetime.fromtimestamp(observation_time, timezone.utc).strftime(
+            OBSERVATION_TIME_FORMAT
+        ),
+        "temperature_celsius": temperature,
+        "humidity_percentage": humidity,
+        "wind_speed_kph": wind_speed,
+        "cloud_coverage_percentage": cloud_coverage,
+        "weather_condition": WEATHER_CONDITIONS[weather_condition],
+        "wind_direction": WIND_DIRECTIONS[wind_direction],
+        "seq": seq,
+        "sent_at": sent_at,
+    }
+
+
+def _encode_json(data: dict) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def _decode_json(payload: bytes) -> dict:
+    return json.loads(payload)
+
+
+ENCODERS = {
+    "struct": _encode_struct,
+    "json": _encode_json,
+}
+DECODERS = {
+    "struct": _decode_struct,
+    "json": _decode_json,
+}
+if msgpack is not None:
+    ENCODERS["msgpack"] = msgpack.packb
+    DECODERS["msgpack"] = msgpack.unpackb
+
+# encodings which can't skip fields
+FIXED_LAYOUT_ENCODINGS = ("struct",)
+# preferred order, the most compact first
+SUPPORTED_ENCODINGS = tuple(
+    encoding for encoding in ("struct", "msgpack", "json") if encoding in ENCODERS
+)
+
+
+def encode_data(data: dict, encoding: str) -> bytes:
+    return encode_frame(MessageType.DATA, ENCODERS[encoding](data))
+
+
+def decode_data(payload: bytes, encoding: str) -> dict:
+    return DECODERS[encoding](payload)
+
+
+def encode_hello(encodings: tuple[str, ...] | list[str]) -> bytes:
+    return encode_frame(
+        MessageType.HELLO, bytes([PROTOCOL_VERSION]) + ",".join(encodings).encode("ascii")
+    )
+
+
+def decode_hello(payload: bytes) -> tuple[int, list[str]]:
+    if not payload:
+        raise ProtocolError("Empty HELLO message")
+    try:
+        encodings = payload[1:].decode("ascii")
+    except UnicodeDecodeError:
+        raise ProtocolError("Encodings must be ascii names")
+    return payload[0], [name for name in encodings.split(",") if name]
+
+
+def encode_welcome(encoding: str) -> bytes:
+    return encode_frame(MessageType.WELCOME, bytes([PROTOCOL_VERSION]) + encoding.encode("ascii"))
+
+
+def decode_welcome(payload: bytes) -> tuple[int, str]:
+    if not payload:
+        raise ProtocolError("Empty WELCOME message")
+    return payload[0], payload[1:].decode("ascii")
+
+
+def encode_error(message: str) -> bytes:
+    return encode_frame(MessageType.ERROR, message.encode())
+
+
+def encode_subscribe(locations: list[str], fields: list[str] | None = None) -> bytes:
+    return encode_frame(
+        MessageType.SUBSCRIBE, _encode_json({"locations": locations, "fields": fields})
+    )
+
+
+def _is_list_of_strings(value) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) and item for item in value)
+
+
+def decode_subscribe(payload: bytes) -> tuple[list[str], list[str] | None]:
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        raise ProtocolError("SUBSCRIBE must be json")
+    if not isinstance(message, dict):
+        raise ProtocolError("SUBSCRIBE must be json object")
+
+    locations = message.get("locations") or []
+    fields = message.get("fields")
+    if not _is_list_of_strings(locations):
+        raise ProtocolError("`locations` must be a list of names")
+    if fields is not None and not _is_list_of_strings(fields):
+        raise ProtocolError("`fields` must be a list of names or null")
+    if len(locations) > MAX_SUBSCRIPTIONS:
+        raise ProtocolError(f"Too many locations, max {MAX_SUBSCRIPTIONS}")
+    # struct encoding keeps 1 byte for location length
+    if any(len(location.encode()) > 255 for location in locations):
+        raise ProtocolError("Location name is too long")
+    return locations, fields
+
+
+def encode_ping() -> bytes:
+    # payload is echoed in PONG, it allows to measure round trip time
+    return encode_frame(MessageType.PING, PING_PAYLOAD.pack(time.monotonic()))
+
+
+def encode_pong(ping_payload: bytes) -> bytes:
+    return encode_frame(MessageType.PONG, ping_payload)
+
+
+def choose_encoding(client_encodings: list[str]) -> str | None:
+    for encoding in client_encodings:
+        if encoding in ENCODERS:
+            return encoding
+    return None
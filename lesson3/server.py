@@ -1,181 +1,348 @@
 import asyncio
 import argparse
-import json
-import random
-from datetime import datetime
+import itertools
+import multiprocessing as mp
+import pickle
+import socket
+import time
+from collections.abc import Coroutine
+from functools import partial
+from multiprocessing.connection import Connection
+
+from broadcast import DEFAULT_QUEUE_SIZE, Broadcaster, SlowConsumerPolicy, make_topics
+from channel import PipeChannel
+from protocol import (
+    PROTOCOL_VERSION,
+    MessageType,
+    ProtocolError,
+    choose_encoding,
+    decode_hello,
+    decode_subscribe,
+    encode_error,
+    encode_pong,
+    encode_welcome,
+    read_frame,
+)
+from weather import generate_readings
+
+DEFAULT_PERIOD = 5
+BACKLOG = 4096
+HANDSHAKE_TIMEOUT = 5
+DEFAULT_HEARTBEAT_INTERVAL = 10
+DEFAULT_IDLE_TIMEOUT = 30
+WORKER_STOP_TIMEOUT = 5
 
 parser = argparse.ArgumentParser(description="Weather server.")
 parser.add_argument('--host', type=str, default="localhost")
 parser.add_argument('--port', type=str, default=8000)
+parser.add_argument(
+    '--queue-size',
+    type=int,
+    default=DEFAULT_QUEUE_SIZE,
+    help="How many messages are kept for a client which doesn't read fast enough.",
+)
+parser.add_argument(
+    '--slow-consumer-policy',
+    type=str,
+    choices=[policy.value for policy in SlowConsumerPolicy],
+    default=SlowConsumerPolicy.DROP_OLDEST.value,
+    help="What to do when the queue of a slow client is full.",
+)
+parser.add_argument('--period', type=float, default=DEFAULT_PERIOD, help="Seconds between ticks.")
+parser.add_argument(
+    '--heartbeat-interval',
+    type=float,
+    default=DEFAULT_HEARTBEAT_INTERVAL,
+    help="Seconds of client silence after which PING is sent.",
+)
+parser.add_argument(
+    '--idle-timeout',
+    type=float,
+    default=DEFAULT_IDLE_TIMEOUT,
+    help="Seconds of client silence after which the client is disconnected.",
+)
+parser.add_argument(
+    '--processes',
+    type=int,
+    default=1,
+    help="Number of worker processes which accept clients on the same port (SO_REUSEPORT).",
+)
 
 
-DEFAULT_PERIOD = 5
-CLIENTS_STREAMS = {}
-SEASONS = {
-    1: "winter",
-    2: "winter",
-    3: "spring",
-    4: "spring",
-    5: "spring",
-    6: "summer",
-    7: "summer",
-    8: "summer",
-    9: "autumn",
-    10: "autumn",
-    11: "autumn",
-    12: "winter",
-}
-
-
-def get_winter_weather_data() -> dict:
-    return {
-        "temperature_celsius": random.choice(list(range(-10, 6))),
-        "humidity_percentage": random.choice(list(range(30, 40))),
-        "wind_speed_kph": random.choice(list(range(8, 12))),
-        "cloud_coverage_percentage": random.choice(list(range(50, 70))),
-        "weather_condition": "Cloudy",
-        "wind_direction": "S"
-    }
-
-
-def get_summer_weather_data() -> dict:
-    return {
-        "temperature_celsius": random.choice(list(range(20, 30))),
-        "humidity_percentage": random.choice(list(range(30, 40))),
-        "wind_speed_kph": random.choice(list(range(1, 3))),
-        "cloud_coverage_percentage": random.choice(list(range(5, 15))),
-        "weather_condition": "Sunny",
-        "wind_direction": "N"
-    }
-
-
-def get_spring_weather_data() -> dict:
-    return {
-        "temperature_celsius": random.choice(list(range(10, 20))),
-        "humidity_percentage": random.choice(list(range(50, 70))),
-        "wind_speed_kph": random.choice(list(range(3, 5))),
-        "cloud_coverage_percentage": random.choice(list(range(30, 40))),
-        "weather_condition": "Sunny/Cloudy",
-        "wind_direction": "E"
-    }
-
-
-def get_autumn_weather_data() -> dict:
-    return {
-        "temperature_celsius": random.choice(list(range(10, 20))),
-        "humidity_percentage": random.choice(list(range(50, 70))),
-        "wind_speed_kph": random.choice(list(range(3, 5))),
-        "cloud_coverage_percentage": random.choice(list(range(30, 40))),
-        "weather_condition": "Sunny/Cloudy",
-        "wind_direction": "W"
-    }
-
-
-SEASONS_HANDLER = {
-    "winter": get_winter_weather_data,
-    "spring": get_spring_weather_data,
-    "summer": get_summer_weather_data,
-    "autumn": get_autumn_weather_data,
-}
-
-
-def generate_weather_data() -> dict:
-    time = datetime.now()
-    season = SEASONS[time.month]
-    handler = SEASONS_HANDLER[season]
-    return {
-        "location": "Lviv",
-        "pressure_hpa": 1000,
-        "observation_time": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
-        **handler(),
-    }
-
-
-def register_client(
-    addr: tuple[str, int],
-    writer: asyncio.StreamWriter
-) -> None:
-    CLIENTS_STREAMS[addr] = writer
-    print(f"Client {addr} was registered")
-
+async def handle_client(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    broadcaster: Broadcaster,
+):
+    addr = writer.get_extra_info("peername")
 
-def unregister_client(addr: tuple[str, int]) -> None:
-    CLIENTS_STREAMS.pop(addr, None)
-    print(f"Client {addr} was unregistered")
+    try:
+        encoding = await handshake(reader, writer)
+    except (ProtocolError, TimeoutError, ConnectionError) as e:
+        print(f"Client {addr} handshake failed: {e!r}")
+        writer.transport.abort()
+        return
+
+    client = broadcaster.register(addr, writer, encoding)
+    # this is also required to unregister client if client closed connection
+    try:
+        while (frame := await read_frame(reader)) is not None:
+            client.last_received_at = time.monotonic()
+            message_type, payload = frame
+            # replies are sent through the client queue, so they are not mixed with data frames
+            if message_type == MessageType.PING:
+                client.send(encode_pong(payload))
+            elif message_type == MessageType.SUBSCRIBE:
+                try:
+                    broadcaster.subscribe(addr, make_topics(*decode_subscribe(payload)))
+                except ProtocolError as e:
+                    client.send(encode_error(str(e)))
+    except (ProtocolError, ConnectionError) as e:
+        print(f"Client {addr} error: {e!r}")
+    # if frame is None it means that client closed connection
+    broadcaster.disconnect(addr)
+
+
+async def handshake(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> str:
+    """
+    Returns encoding chosen for the client.
+    """
+    async with asyncio.timeout(HANDSHAKE_TIMEOUT):
+        frame = await read_frame(reader)
+    if frame is None:
+        raise ConnectionError("Connection closed during handshake")
+
+    message_type, payload = frame
+    if message_type != MessageType.HELLO:
+        raise ProtocolError(f"HELLO expected, {message_type.name} received")
+
+    version, client_encodings = decode_hello(payload)
+    if version != PROTOCOL_VERSION:
+        error = f"Unsupported protocol version {version}"
+    elif (encoding := choose_encoding(client_encodings)) is None:
+        error = f"None of encodings {client_encodings} is supported"
+    else:
+        writer.write(encode_welcome(encoding))
+        await writer.drain()
+        return encoding
+
+    writer.write(encode_error(error))
+    await writer.drain()
+    raise ProtocolError(error)
 
 
-async def close_connection(writer: asyncio.StreamWriter) -> None:
-    writer.close()
-    await writer.wait_closed()
+def get_readings(locations: set[str], seq: int) -> dict[str, dict]:
+    """
+    `seq` is the tick number, so clients can detect lost and reordered messages.
+    `sent_at` (unix time) is used by clients to measure delivery latency.
+    """
+    return generate_readings(locations, extra={"seq": seq, "sent_at": time.time()})
 
 
-async def close_connections():
-    print("\nClosing clients connections...")
-    close_sockets_tasks = []
-    clients = CLIENTS_STREAMS.copy()
+def broadcast_readings(broadcaster: Broadcaster, readings: dict[str, dict], prefix: str = ""):
+    if not broadcaster.clients:
+        return
+    sent_messages = broadcaster.broadcast(readings)
+    print(
+        f"{prefix}Weather data for {len(readings)} locations was sent to {len(broadcaster)} "
+        f"clients ({sent_messages} messages)"
+    )
 
-    for addr, writer in clients.items():
-        if addr in CLIENTS_STREAMS:
-            unregister_client(addr)
-            close_sockets_tasks.append(asyncio.create_task(close_connection(writer)))
-    await asyncio.gather(*close_sockets_tasks)
 
+async def send_periodic_weather_data(
+    broadcaster: Broadcaster, period: float = DEFAULT_PERIOD
+):
+    """
+    Data of a tick is serialized once and put to every client's buffer without waiting,
+    so a slow client doesn't delay the tick, it's handled by its own writer task.
+    Data is generated only for locations which have subscribers.
+    """
+    for seq in itertools.count():
+        if broadcaster.clients:
+            broadcast_readings(broadcaster, get_readings(broadcaster.get_active_locations(), seq))
 
-async def send_weather_data(
-    addr: tuple[str, int],
-    writer: asyncio.StreamWriter, data: bytes
-) -> None:
-    print(f"Sending weather data to {addr}")
-    writer.write(data)
-    await writer.drain()
+        await asyncio.sleep(period)
 
 
-async def handle_client(
-    reader: asyncio.StreamReader,
-    writer: asyncio.StreamWriter,
-):
-    addr = writer.get_extra_info("peername")
-    register_client(addr, writer)
+async def receive_weather_data(broadcaster: Broadcaster, connection: Connection, prefix: str):
+    """
+    Worker side of the generator pipe: readings of every tick are broadcast to clients
+    of this worker, then active locations are reported back when they were changed.
+    So a new location is received one tick after the first client subscribed to it.
+    Returns when the generator process closed the pipe.
+    """
+    closed = asyncio.Event()
+    reported_locations: set[str] = set()
+
+    def on_readings(payload: bytes) -> None:
+        nonlocal reported_locations
+        broadcast_readings(broadcaster, pickle.loads(payload), prefix)
+        active_locations = broadcaster.get_active_locations()
+        if active_locations != reported_locations:
+            channel.send(pickle.dumps(active_locations))
+            reported_locations = active_locations
+
+    channel = PipeChannel(connection, on_readings, closed.set)
+    try:
+        await closed.wait()
+    finally:
+        channel.close()
+
+
+async def send_weather_data_to_workers(connections: list[Connection], period: float):
+    """
+    Generator side: readings are generated once for the union of locations active in
+    any worker, pickled once and the same bytes are sent to every worker.
+    Pipes are written without blocking, a stalled worker loses old ticks
+    and doesn't delay other workers.
+    """
+    active_locations = [set() for _ in connections]
+    closed = set()
+
+    def on_active_locations(index: int, payload: bytes) -> None:
+        active_locations[index] = pickle.loads(payload)
+
+    def on_close(index: int) -> None:
+        active_locations[index] = set()
+        closed.add(index)
+
+    channels = [
+        PipeChannel(connection, partial(on_active_locations, index), partial(on_close, index))
+        for index, connection in enumerate(connections)
+    ]
+    try:
+        for seq in itertools.count():
+            if len(closed) == len(channels):
+                return
+            payload = pickle.dumps(get_readings(set().union(*active_locations), seq))
+            for channel in channels:
+                channel.send(payload)
+
+            await asyncio.sleep(period)
+    finally:
+        for channel in channels:
+            channel.close()
+
+
+async def reap_dead_clients(
+    broadcaster: Broadcaster, heartbeat_interval: float, idle_timeout: float
+) -> None:
+    """
+    Checks run more often than the heartbeat interval: a client is pinged at most a half
+    of `idle_timeout - heartbeat_interval` later than it became silent for the interval,
+    so it has time to answer before the idle timeout.
+    """
+    check_period = min(heartbeat_interval, idle_timeout - heartbeat_interval) / 2
+    while True:
+        await asyncio.sleep(check_period)
+        broadcaster.check_heartbeats(heartbeat_interval, idle_timeout)
 
-    # this is required to unregister client if client closed connection
-    data = await reader.read(100)
-    # if data is empty it means that client closed connection
-    if not data:
-        if addr in CLIENTS_STREAMS:
-            unregister_client(addr)
 
+def make_broadcaster(args: argparse.Namespace) -> Broadcaster:
+    return Broadcaster(
+        queue_size=args.queue_size, policy=SlowConsumerPolicy(args.slow_consumer_policy)
+    )
 
-async def send_periodic_weather_data(period: int = DEFAULT_PERIOD):
-    while True:
-        if CLIENTS_STREAMS:
-            data = generate_weather_data()
-            json_data = json.dumps(data, indent=4)
-            encoded_data = json_data.encode()
-
-            send_weather_tasks = []
-            for addr, client_writer in CLIENTS_STREAMS.items():
-                send_weather_tasks.append(
-                    asyncio.create_task(send_weather_data(addr, client_writer, encoded_data))
-                )
-            await asyncio.gather(*send_weather_tasks)
 
-        await asyncio.sleep(period)
+async def serve(
+    args: argparse.Namespace,
+    broadcaster: Broadcaster,
+    ticks: Coroutine,
+    reuse_port: bool = False,
+) -> None:
+    server = await asyncio.start_server(
+        partial(handle_client, broadcaster=broadcaster),
+        args.host,
+        args.port,
+        # default backlog is 100, connections are dropped when thousands of clients connect
+        backlog=BACKLOG,
+        # every worker process has its own listening socket on the same port,
+        # kernel balances new connections between them
+        reuse_port=reuse_port,
+    )
+    async with server:
+        run_time_tasks = [
+            asyncio.create_task(server.serve_forever()),
+            asyncio.create_task(ticks),
+            asyncio.create_task(
+                reap_dead_clients(broadcaster, args.heartbeat_interval, args.idle_timeout)
+            ),
+        ]
+        try:
+            # server runs forever, ticks are finished when the generator process is stopped
+            await asyncio.wait(run_time_tasks, return_when=asyncio.FIRST_COMPLETED)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            pass
+        print("\nClosing clients connections...")
+        for task in run_time_tasks:
+            task.cancel()
+        await broadcaster.close()
+
+
+async def run_worker(args: argparse.Namespace, connection: Connection, index: int) -> None:
+    broadcaster = make_broadcaster(args)
+    prefix = f"Worker {index}: "
+    await serve(
+        args, broadcaster, receive_weather_data(broadcaster, connection, prefix), reuse_port=True
+    )
+
+
+def run_worker_process(args: argparse.Namespace, connection: Connection, index: int) -> None:
+    try:
+        asyncio.run(run_worker(args, connection, index))
+    except KeyboardInterrupt:
+        pass
+
+
+async def serve_by_processes(args: argparse.Namespace) -> None:
+    """
+    One event loop is limited by one core. Every worker process accepts its own clients
+    on the same port (SO_REUSEPORT), this process only generates weather data.
+    """
+    # forked workers would inherit generator ends of pipes (so they never see EOF)
+    # and SIGINT handler of the running event loop
+    context = mp.get_context("spawn")
+    connections = []
+    processes = []
+    for index in range(args.processes):
+        connection, worker_connection = context.Pipe()
+        process = context.Process(
+            target=run_worker_process, args=(args, worker_connection, index), daemon=True
+        )
+        process.start()
+        worker_connection.close()
+        connections.append(connection)
+        processes.append(process)
+
+    try:
+        await send_weather_data_to_workers(connections, args.period)
+    except (asyncio.CancelledError, KeyboardInterrupt):
+        pass
+    finally:
+        # workers stop when the pipe is closed
+        for connection in connections:
+            connection.close()
+        for process in processes:
+            process.join(timeout=WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
 
 
 async def main():
     args = parser.parse_args()
+    if args.processes > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--processes requires SO_REUSEPORT which is not supported by this platform")
+    if args.queue_size < 1:
+        parser.error("--queue-size must be a positive number")
+    if args.idle_timeout <= args.heartbeat_interval:
+        parser.error("--idle-timeout must be greater than --heartbeat-interval")
     print(f"Server starts: {args.host}:{args.port}")
 
-    server = await asyncio.start_server(handle_client, args.host, args.port)
-    async with server:
-        try:
-            run_time_tasks = [
-                asyncio.create_task(server.serve_forever()),
-                asyncio.create_task(send_periodic_weather_data())
-            ]
-            await asyncio.gather(*run_time_tasks)
-        except (asyncio.CancelledError, KeyboardInterrupt):
-            await close_connections()
+    if args.processes > 1:
+        await serve_by_processes(args)
+    else:
+        broadcaster = make_broadcaster(args)
+        await serve(args, broadcaster, send_periodic_weather_data(broadcaster, args.period))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,127 @@
+"""
+Weather data generator.
+
+Ranges of seasons are precomputed, every field is drawn for all locations of the tick at once
+and readings are built in one pass, no lists are built per reading.
+"""
+import random
+from datetime import datetime
+from typing import NamedTuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from protocol import OBSERVATION_TIME_FORMAT
+
+PRESSURE_HPA = 1000
+# numpy call has a fixed overhead, random.choices is faster for small batches
+NUMPY_MIN_BATCH_SIZE = 256
+
+SEASONS = {
+    1: "winter",
+    2: "winter",
+    3: "spring",
+    4: "spring",
+    5: "spring",
+    6: "summer",
+    7: "summer",
+    8: "summer",
+    9: "autumn",
+    10: "autumn",
+    11: "autumn",
+    12: "winter",
+}
+
+
+class SeasonProfile(NamedTuple):
+    temperature_celsius: range
+    humidity_percentage: range
+    wind_speed_kph: range
+    cloud_coverage_percentage: range
+    weather_condition: str
+    wind_direction: str
+
+
+RANDOM_FIELDS = (
+    "temperature_celsius",
+    "humidity_percentage",
+    "wind_speed_kph",
+    "cloud_coverage_percentage",
+)
+
+SEASON_PROFILES = {
+    "winter": SeasonProfile(
+        temperature_celsius=range(-10, 6),
+        humidity_percentage=range(30, 40),
+        wind_speed_kph=range(8, 12),
+        cloud_coverage_percentage=range(50, 70),
+        weather_condition="Cloudy",
+        wind_direction="S",
+    ),
+    "spring": SeasonProfile(
+        temperature_celsius=range(10, 20),
+        humidity_percentage=range(50, 70),
+        wind_speed_kph=range(3, 5),
+        cloud_coverage_percentage=range(30, 40),
+        weather_condition="Sunny/Cloudy",
+        wind_direction="E",
+    ),
+    "summer": SeasonProfile(
+        temperature_celsius=range(20, 30),
+        humidity_percentage=range(30, 40),
+        wind_speed_kph=range(1, 3),
+        cloud_coverage_percentage=range(5, 15),
+        weather_condition="Sunny",
+        wind_direction="N",
+    ),
+    "autumn": SeasonProfile(
+        temperature_celsius=range(10, 20),
+        humidity_percentage=range(50, 70),
+        wind_speed_kph=range(3, 5),
+        cloud_coverage_percentage=range(30, 40),
+        weather_condition="Sunny/Cloudy",
+        wind_direction="W",
+    ),
+}
+
+_numpy_generator = np.random.default_rng() if np is not None else None
+
+
+def draw(values: range, count: int) -> list[int]:
+    if _numpy_generator is not None and count >= NUMPY_MIN_BATCH_SIZE:
+        # tolist converts numpy ints to python ints, encoders don't support numpy types
+        return _numpy_generator.integers(values.start, values.stop, count).tolist()
+    return random.choices(values, k=count)
+
+
+def generate_readings(
+    locations: list[str] | set[str], now: datetime | None = None, extra: dict | None = None
+) -> dict[str, dict]:
+    """
+    Returns location -> reading. `extra` fields are added to every reading.
+    """
+    locations = list(locations)
+    now = now or datetime.now()
+    profile = SEASON_PROFILES[SEASONS[now.month]]
+    common = {
+        "pressure_hpa": PRESSURE_HPA,
+        "observation_time": now.strftime(OBSERVATION_TIME_FORMAT),
+        "weather_condition": profile.weather_condition,
+        "wind_direction": profile.wind_direction,
+        **(extra or {}),
+    }
+    columns = [draw(getattr(profile, field), len(locations)) for field in RANDOM_FIELDS]
+    return {
+        location: {
+            "location": location,
+            "temperature_celsius": temperature,
+            "humidity_percentage": humidity,
+            "wind_speed_kph": wind_speed,
+            "cloud_coverage_percentage": cloud_coverage,
+            **common,
+        }
+        for location, temperature, humidity, wind_speed, cloud_coverage in zip(locations, *columns)
+    }
+
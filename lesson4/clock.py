@@ -0,0 +1,19 @@
+import asyncio
+
+
+class Clock:
+    """
+    Simulated time: `scale` simulated seconds pass in one real second, so a simulation
+    of minutes takes seconds. Time is taken from the event loop, so the clock also works
+    with an event loop with virtual time.
+    """
+
+    def __init__(self, scale: float = 1.0) -> None:
+        self.scale = scale
+        self._started_at = asyncio.get_running_loop().time()
+
+    def now(self) -> float:
+        return (asyncio.get_running_loop().time() - self._started_at) * self.scale
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds / self.scale)
@@ -1,10 +1,48 @@
+import argparse
 import asyncio
 import enum
 import random
-
-PHILOSOPHERS_NUMBER = 5
-FORKS_NUMBER = PHILOSOPHERS_NUMBER
-PHILOSOPHERS_COMPLETED_MEAL = [False] * 5
+import time
+
+from clock import Clock
+from metrics import PhilosopherMetrics, SimulationMetrics, print_report, save_report
+from strategies import STRATEGIES, OrderedForksStrategy, Strategy
+from virtual_loop import VirtualTimeEventLoop
+
+DEFAULT_PHILOSOPHERS_NUMBER = 5
+
+parser = argparse.ArgumentParser(description="Dining philosophers.")
+parser.add_argument('--philosophers', type=int, default=DEFAULT_PHILOSOPHERS_NUMBER)
+parser.add_argument(
+    '--strategy',
+    type=str,
+    choices=list(STRATEGIES),
+    default=OrderedForksStrategy.name,
+    help="How philosophers take forks.",
+)
+parser.add_argument(
+    '--duration',
+    type=float,
+    default=None,
+    help="Simulated seconds, the simulation runs until Ctrl+C by default.",
+)
+parser.add_argument(
+    '--time-scale',
+    type=float,
+    default=1.0,
+    help="Simulated seconds in one real second.",
+)
+parser.add_argument(
+    '--virtual-time',
+    action="store_true",
+    help="Don't wait real time, the clock jumps to the next timer. "
+    "Together with --seed every run gives the same results.",
+)
+parser.add_argument('--seed', type=int, default=None, help="Seed of the random generator.")
+parser.add_argument('--quiet', action="store_true", help="Print only the report.")
+parser.add_argument(
+    '--metrics-file', type=str, default=None, help="Save the report as json at shutdown."
+)
 
 
 class State(enum.Enum):
@@ -15,20 +53,23 @@ class State(enum.Enum):
     FINISHING_MEAL = "FINISHING_MEAL"
 
 
-class Fork(asyncio.Lock):
-    def __init__(self, fork_id: int, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self._fork_id = fork_id
-
-    def __str__(self) -> str:
-        return f"Fork({self._fork_id})"
-
-
 class Philosopher:
-    def __init__(self, id: int, first_fork: Fork, second_fork: Fork):
+    def __init__(
+        self,
+        id: int,
+        strategy: Strategy,
+        clock: Clock,
+        rng: random.Random,
+        metrics: PhilosopherMetrics,
+        quiet: bool = False,
+    ):
         self.id = id
-        self.first_fork = first_fork
-        self.second_fork = second_fork
+        self.index = id - 1
+        self.strategy = strategy
+        self.clock = clock
+        self.rng = rng
+        self.metrics = metrics
+        self.quiet = quiet
         self.state = State.READY
 
     def __repr__(self) -> str:
@@ -37,102 +78,106 @@ class Philosopher:
     def __str__(self) -> str:
         return repr(self)
 
+    def log(self, message: str) -> None:
+        if not self.quiet:
+            print(f"[{self.clock.now():.3f}] {self} {message}")
+
     async def dine(self):
-        print(f"{self} has started lunch")
+        self.log("has started lunch")
         while True:
             await self.think()
             await self.take_forks()
-            # break
 
     async def think(self):
         self.state = State.THINKING
-        delay = _get_random_action_time()
-        print(f"{self} is thinking for {delay} seconds")
-        await asyncio.sleep(delay)
+        delay = _get_random_action_time(self.rng)
+        # messages are not even built in quiet mode, it matters when there are 100k philosophers
+        if not self.quiet:
+            self.log(f"is thinking for {delay} seconds")
+        await self.clock.sleep(delay)
 
     async def take_forks(self):
         self.state = State.HUNGRY
+        self.log("is hungry and is waiting for forks")
+        hungry_at = self.clock.now()
+        await self.strategy.take_forks(self.index)
+        self.metrics.record_meal(self.index, hungry_at)
 
-        async with self.first_fork:
-            print(
-                f"{self} has just taken the first {self.first_fork} "
-                f"and is waiting for the second one"
-            )
-            async with self.second_fork:
-                print(
-                    f"{self} has just taken the second "
-                    f"{self.second_fork} and is ready to eat"
-                )
-                await self.eat()
-                self.state = State.FINISHING_MEAL
-
-            print(f"{self} has put down the {self.second_fork}")
-
-        print(
-            f"{self} has put down "
-            f"the {self.first_fork} and going to start thinking"
-        )
-
-        completion_status = PHILOSOPHERS_COMPLETED_MEAL[self.id - 1]
-        if not completion_status:
-             PHILOSOPHERS_COMPLETED_MEAL[self.id - 1] = True
+        self.log("has taken forks and is ready to eat")
+        await self.eat()
+        self.state = State.FINISHING_MEAL
+        self.strategy.put_forks(self.index)
+        self.log("has put down forks and going to start thinking")
 
     async def eat(self) -> None:
         self.state = State.EATING
-        delay = _get_random_action_time()
-        print(f"{self} is eating for {delay} seconds")
-        await asyncio.sleep(delay)
-
-
-def _get_random_action_time() -> float:
-    return random.randint(1000, 5000) / 1000
-
-
-def _get_forks_indexes(philosopher_index: int, forks_number: int = FORKS_NUMBER) -> list[int]:
-    """
-    Return ordered list of indexes.
-    First fork index will be less than index of second.
-    This is an important requirement to avoid DeadLocks.
-    It guarantees that one of the philosophers is able to acquire two forks.
-    Example of first fork (F) for philosophers (P):
-        P1: F1
-        P2: F1
-        P3: F2
-        P4: F3
-        P5: F4
-    From this example we can see that none of the philosophers on the beginning of the process
-    try to acquire F(5), it means that either P(1) or P(5) can acquire two forks.
-    Example for the situation when we don't have delays.
-    With delays at thinking or eating process it's adding additional conditions when the other
-    philosopher can acquire two forks too.
-    """
-    left_index = philosopher_index
-    right_index = (philosopher_index + forks_number - 1) % forks_number
-    return sorted([left_index, right_index])
-
-
-async def main():
-    forks = [Fork(i + 1) for i in range(FORKS_NUMBER)]
-
-    philosophers = []
-    for i in range(PHILOSOPHERS_NUMBER):
-        first_fork_index, second_fork_index = _get_forks_indexes(i, FORKS_NUMBER)
-        philosophers.append(
-            Philosopher(
-                id=i + 1, first_fork=forks[first_fork_index], second_fork=forks[second_fork_index]
-            )
-        )
+        delay = _get_random_action_time(self.rng)
+        if not self.quiet:
+            self.log(f"is eating for {delay} seconds")
+        await self.clock.sleep(delay)
 
+
+def _get_random_action_time(rng: random.Random) -> float:
+    return rng.randint(1000, 5000) / 1000
+
+
+async def simulate(args: argparse.Namespace, philosophers: list[Philosopher], clock: Clock):
     tasks = [asyncio.create_task(philosopher.dine()) for philosopher in philosophers]
-    await asyncio.gather(*tasks)
+    try:
+        if args.duration is None:
+            await asyncio.gather(*tasks)
+        else:
+            await clock.sleep(args.duration)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def validate_args(args: argparse.Namespace) -> None:
+    if args.philosophers < 2:
+        parser.error("at least 2 philosophers are required")
+    if args.time_scale <= 0:
+        parser.error("--time-scale must be positive")
+
+
+async def main(args: argparse.Namespace):
+    clock = Clock(args.time_scale)
+    rng = random.Random(args.seed)
+    metrics = SimulationMetrics(args.philosophers, clock)
+    strategy = STRATEGIES[args.strategy](args.philosophers, metrics.forks)
+    philosophers = [
+        Philosopher(
+            id=i + 1,
+            strategy=strategy,
+            clock=clock,
+            rng=rng,
+            metrics=metrics.philosophers,
+            quiet=args.quiet,
+        )
+        for i in range(args.philosophers)
+    ]
+
+    started_at = time.perf_counter()
+    try:
+        await simulate(args, philosophers, clock)
+    except asyncio.CancelledError:
+        # Ctrl+C, the report is printed anyway
+        pass
+
+    report = metrics.get_report(args.strategy, time.perf_counter() - started_at)
+    print_report(report)
+    if args.metrics_file:
+        save_report(report, args.metrics_file)
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
+    validate_args(args)
     try:
-        asyncio.run(main())
+        with asyncio.Runner(
+            loop_factory=VirtualTimeEventLoop if args.virtual_time else None
+        ) as runner:
+            runner.run(main(args))
     except KeyboardInterrupt:
-        for index, completed in enumerate(PHILOSOPHERS_COMPLETED_MEAL, start=1):
-            if completed:
-                print(f"Philoshoper(id={index}) has finished eating at least once")
-            else:
-                print(f"Philoshoper(id={index}) has not finished eating yet")
+        pass
@@ -0,0 +1,204 @@
+"""
+Contention and fairness metrics of the simulation.
+
+Metrics are kept in arrays indexed by fork / philosopher (not in objects per fork),
+so 100k philosophers take a few megabytes. All times are simulated seconds.
+"""
+import json
+import os
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from clock import Clock
+
+# upper bounds of histogram buckets, the last bucket is everything above
+WAIT_TIME_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60)
+PERCENTILES = (50, 90, 99)
+TOP_NUMBER = 5
+
+
+def get_percentiles(values: list[float] | array) -> dict[str, float]:
+    if not values:
+        return {}
+    sorted_values = sorted(values)
+    last_index = len(sorted_values) - 1
+    return {
+        f"p{percentile}": sorted_values[round(last_index * percentile / 100)]
+        for percentile in PERCENTILES
+    }
+
+
+def get_jain_index(values: list[float] | array) -> float:
+    """
+    Jain's fairness index: 1 when everybody got the same, 1 / n when one got everything.
+    """
+    squares_sum = sum(value * value for value in values)
+    if not squares_sum:
+        return 0.0
+    return sum(values) ** 2 / (len(values) * squares_sum)
+
+
+def get_top(values: array, number: int = TOP_NUMBER) -> list[tuple[int, float]]:
+    """
+    Returns (id, value) of the biggest values, id is 1-based like ids of forks and philosophers.
+    """
+    indexes = sorted(range(len(values)), key=values.__getitem__, reverse=True)[:number]
+    return [(index + 1, round(values[index], 3)) for index in indexes if values[index]]
+
+
+class Histogram:
+    def __init__(self, bounds: tuple[float, ...] = WAIT_TIME_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+    def add(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+
+    def to_dict(self) -> dict[str, int]:
+        keys = [f"<={bound}" for bound in self.bounds] + [f">{self.bounds[-1]}"]
+        return dict(zip(keys, self.counts))
+
+
+class ForkMetrics:
+    """
+    Acquisition is contended when the fork was taken by the neighbour at the moment of request.
+    """
+
+    def __init__(self, forks_number: int, clock: Clock) -> None:
+        self.clock = clock
+        self.acquisitions = array("L", [0]) * forks_number
+        self.contentions = array("L", [0]) * forks_number
+        self.wait_time = array("d", [0]) * forks_number
+        self.hold_time = array("d", [0]) * forks_number
+        self.wait_histogram = Histogram()
+
+    def record_acquire(self, fork_index: int, wait_time: float, contended: bool) -> None:
+        self.acquisitions[fork_index] += 1
+        self.contentions[fork_index] += contended
+        self.wait_time[fork_index] += wait_time
+        self.wait_histogram.add(wait_time)
+
+    def record_release(self, fork_index: int, hold_time: float) -> None:
+        self.hold_time[fork_index] += hold_time
+
+    def get_report(self) -> dict:
+        acquisitions = sum(self.acquisitions)
+        contentions = sum(self.contentions)
+        wait_time = sum(self.wait_time)
+        return {
+            "acquisitions": acquisitions,
+            "contended_acquisitions": contentions,
+            "contention_rate": contentions / acquisitions if acquisitions else 0,
+            "wait_time": wait_time,
+            "mean_wait_time": wait_time / acquisitions if acquisitions else 0,
+            "mean_hold_time": sum(self.hold_time) / acquisitions if acquisitions else 0,
+            "wait_time_histogram": self.wait_histogram.to_dict(),
+            "most_waited_forks": get_top(self.wait_time),
+        }
+
+
+class PhilosopherMetrics:
+    """
+    Starvation streak is the time between meals (or from the start to the first meal):
+    thinking + waiting for forks. The current streak is taken into account at the end too.
+    """
+
+    def __init__(self, philosophers_number: int, clock: Clock) -> None:
+        self.clock = clock
+        self.meals = array("L", [0]) * philosophers_number
+        self.hungry_time = array("d", [0]) * philosophers_number
+        self.max_starvation = array("d", [0]) * philosophers_number
+        self.last_meal_at = array("d", [clock.now()]) * philosophers_number
+        self.hungry_time_histogram = Histogram()
+
+    def record_meal(self, philosopher_index: int, hungry_at: float) -> None:
+        """
+        Must be called when the philosopher has started eating.
+        """
+        now = self.clock.now()
+        self.meals[philosopher_index] += 1
+        self.hungry_time[philosopher_index] += now - hungry_at
+        self.hungry_time_histogram.add(now - hungry_at)
+        self._update_starvation(philosopher_index, now)
+        self.last_meal_at[philosopher_index] = now
+
+    def _update_starvation(self, philosopher_index: int, now: float) -> None:
+        streak = now - self.last_meal_at[philosopher_index]
+        if streak > self.max_starvation[philosopher_index]:
+            self.max_starvation[philosopher_index] = streak
+
+    def get_report(self, simulated_time: float) -> dict:
+        now = self.clock.now()
+        for index in range(len(self.meals)):
+            self._update_starvation(index, now)
+
+        meals = sum(self.meals)
+        return {
+            "meals": meals,
+            "meals_per_second": meals / simulated_time if simulated_time else 0,
+            "min_meals": min(self.meals),
+            "max_meals": max(self.meals),
+            "not_eaten": self.meals.count(0),
+            "jain_index": get_jain_index(self.meals),
+            "mean_hungry_time": sum(self.hungry_time) / meals if meals else 0,
+            "hungry_time_histogram": self.hungry_time_histogram.to_dict(),
+            "max_starvation": get_percentiles(self.max_starvation),
+            "most_starved_philosophers": get_top(self.max_starvation),
+        }
+
+
+class SimulationMetrics:
+    def __init__(self, philosophers_number: int, clock: Clock) -> None:
+        self.clock = clock
+        self.forks = ForkMetrics(philosophers_number, clock)
+        self.philosophers = PhilosopherMetrics(philosophers_number, clock)
+
+    def get_report(self, strategy: str, real_time: float) -> dict:
+        simulated_time = self.clock.now()
+        return {
+            "strategy": strategy,
+            "philosophers_number": len(self.philosophers.meals),
+            "simulated_time": simulated_time,
+            "real_time": real_time,
+            "philosophers": self.philosophers.get_report(simulated_time),
+            "forks": self.forks.get_report(),
+        }
+
+
+def print_report(report: dict) -> None:
+    philosophers = report["philosophers"]
+    forks = report["forks"]
+    print(
+        f"Strategy {report['strategy']}: simulated {report['simulated_time']:.1f} seconds "
+        f"in {report['real_time']:.2f} real seconds"
+    )
+    print(
+        f"Meals: {philosophers['meals']} ({philosophers['meals_per_second']:.2f}/s), "
+        f"per philosopher min {philosophers['min_meals']}, max {philosophers['max_meals']}, "
+        f"{philosophers['not_eaten']} of {report['philosophers_number']} have not eaten yet, "
+        f"Jain's fairness index {philosophers['jain_index']:.3f}"
+    )
+    print(
+        f"Hungry time per meal: mean {philosophers['mean_hungry_time']:.3f}s, "
+        f"histogram {philosophers['hungry_time_histogram']}"
+    )
+    print(
+        "Max starvation streak per philosopher: "
+        + " ".join(f"{key}={value:.1f}s" for key, value in philosophers["max_starvation"].items())
+        + f", the most starved (id, seconds): {philosophers['most_starved_philosophers']}"
+    )
+    print(
+        f"Forks: {forks['acquisitions']} acquisitions, "
+        f"{forks['contention_rate']:.1%} contended, "
+        f"mean wait {forks['mean_wait_time']:.3f}s, mean hold {forks['mean_hold_time']:.3f}s"
+    )
+    print(f"Fork wait time histogram: {forks['wait_time_histogram']}")
+    print(f"The most waited forks (id, seconds): {forks['most_waited_forks']}")
+
+
+def save_report(report: dict, file_path: str | Path) -> None:
+    tmp_file_path = Path(file_path).with_name(f"{Path(file_path).name}.part")
+    with open(tmp_file_path, "w") as file_:
+        json.dump(report, file_, indent=4)
+    os.replace(tmp_file_path, file_path)
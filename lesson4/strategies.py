@@ -0,0 +1,254 @@
+"""
+Strategies of taking forks.
+
+Philosopher `i` (0-based) sits between fork `i` (left) and fork `i - 1` (right),
+so every fork is shared by two neighbours.
+"""
+import asyncio
+
+from metrics import ForkMetrics
+
+
+class Fork(asyncio.Lock):
+    """
+    Wait time, contention and hold time are recorded when `metrics` is given.
+    """
+
+    def __init__(self, fork_id: int, metrics: ForkMetrics | None = None, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._fork_id = fork_id
+        self._metrics = metrics
+        self._acquired_at = 0.0
+
+    def __str__(self) -> str:
+        return f"Fork({self._fork_id})"
+
+    async def acquire(self) -> bool:
+        if self._metrics is None:
+            return await super().acquire()
+
+        # lock can be free but promised to a woken up waiter
+        contended = self.locked() or bool(self._waiters)
+        started_at = self._metrics.clock.now()
+        await super().acquire()
+        self._acquired_at = self._metrics.clock.now()
+        self._metrics.record_acquire(
+            self._fork_id - 1, self._acquired_at - started_at, contended
+        )
+        return True
+
+    def release(self) -> None:
+        if self._metrics is not None:
+            self._metrics.record_release(
+                self._fork_id - 1, self._metrics.clock.now() - self._acquired_at
+            )
+        super().release()
+
+
+def get_forks_indexes(philosopher_index: int, forks_number: int) -> tuple[int, int]:
+    """
+    Returns (left, right) fork indexes.
+    """
+    return philosopher_index, (philosopher_index + forks_number - 1) % forks_number
+
+
+class Strategy:
+    name = ""
+
+    def __init__(self, philosophers_number: int, metrics: ForkMetrics | None = None) -> None:
+        self.philosophers_number = philosophers_number
+        self.metrics = metrics
+
+    async def take_forks(self, philosopher_index: int) -> None:
+        raise NotImplementedError
+
+    def put_forks(self, philosopher_index: int) -> None:
+        raise NotImplementedError
+
+
+class OrderedForksStrategy(Strategy):
+    """
+    Resource ordering: the fork with the lower index is taken first.
+    This is an important requirement to avoid DeadLocks.
+    It guarantees that one of the philosophers is able to acquire two forks.
+    Example of first fork (F) for philosophers (P):
+        P1: F1
+        P2: F1
+        P3: F2
+        P4: F3
+        P5: F4
+    From this example we can see that none of the philosophers on the beginning of the process
+    try to acquire F(5), it means that either P(1) or P(5) can acquire two forks.
+    """
+
+    name = "ordered"
+
+    def __init__(self, philosophers_number: int, metrics: ForkMetrics | None = None) -> None:
+        super().__init__(philosophers_number, metrics)
+        self.forks = [Fork(i + 1, metrics) for i in range(philosophers_number)]
+
+    def _get_forks(self, philosopher_index: int) -> tuple[Fork, Fork]:
+        first_index, second_index = sorted(
+            get_forks_indexes(philosopher_index, self.philosophers_number)
+        )
+        return self.forks[first_index], self.forks[second_index]
+
+    async def take_forks(self, philosopher_index: int) -> None:
+        first_fork, second_fork = self._get_forks(philosopher_index)
+        await first_fork.acquire()
+        try:
+            await second_fork.acquire()
+        except asyncio.CancelledError:
+            first_fork.release()
+            raise
+
+    def put_forks(self, philosopher_index: int) -> None:
+        for fork in self._get_forks(philosopher_index):
+            fork.release()
+
+
+class WaiterStrategy(Strategy):
+    """
+    Arbiter: the waiter (semaphore) lets at most N - 1 philosophers to take forks at the same time,
+    so at least one of them gets both forks, forks are taken left then right.
+    """
+
+    name = "waiter"
+
+    def __init__(self, philosophers_number: int, metrics: ForkMetrics | None = None) -> None:
+        super().__init__(philosophers_number, metrics)
+        self.forks = [Fork(i + 1, metrics) for i in range(philosophers_number)]
+        self.waiter = asyncio.Semaphore(philosophers_number - 1)
+
+    def _get_forks(self, philosopher_index: int) -> tuple[Fork, Fork]:
+        left_index, right_index = get_forks_indexes(philosopher_index, self.philosophers_number)
+        return self.forks[left_index], self.forks[right_index]
+
+    async def take_forks(self, philosopher_index: int) -> None:
+        left_fork, right_fork = self._get_forks(philosopher_index)
+        taken_forks = []
+        await self.waiter.acquire()
+        try:
+            for fork in (left_fork, right_fork):
+                await fork.acquire()
+                taken_forks.append(fork)
+        except asyncio.CancelledError:
+            for fork in taken_forks:
+                fork.release()
+            self.waiter.release()
+            raise
+
+    def put_forks(self, philosopher_index: int) -> None:
+        for fork in self._get_forks(philosopher_index):
+            fork.release()
+        self.waiter.release()
+
+
+class ChandyMisraFork:
+    __slots__ = ("neighbours", "owner", "dirty", "requested")
+
+    def __init__(self, neighbours: tuple[int, int]) -> None:
+        self.neighbours = neighbours
+        # initially the fork is owned by the philosopher with the lower index
+        self.owner = min(neighbours)
+        # fork is cleaned when it's given to a neighbour and becomes dirty after eating
+        self.dirty = True
+        # the neighbour who doesn't own the fork has sent the request token
+        self.requested = False
+
+    def get_other(self, philosopher_index: int) -> int:
+        first, second = self.neighbours
+        return second if philosopher_index == first else first
+
+
+class ChandyMisraStrategy(Strategy):
+    """
+    Chandy-Misra: a fork is owned by one of the neighbours and is passed on request.
+    The owner gives a requested fork away only if it's dirty and the owner is not eating,
+    a clean fork is kept until the owner has eaten. So a philosopher who has just eaten
+    gives priority to the neighbours and nobody starves.
+    Initially forks are dirty and owned by the philosopher with the lower index,
+    precedence graph is acyclic, so there is no deadlock.
+    All philosophers are in one event loop, so request tokens and forks are passed
+    by changing the state of the fork.
+    Forks are not locks here, the wait time of a fork is the time from the first request
+    until the philosopher has both forks, the hold time is the eating time.
+    """
+
+    name = "chandy-misra"
+
+    def __init__(self, philosophers_number: int, metrics: ForkMetrics | None = None) -> None:
+        super().__init__(philosophers_number, metrics)
+        # fork `i` is the left fork of philosopher `i` and the right fork of philosopher `i + 1`
+        self.forks = [
+            ChandyMisraFork((i, (i + 1) % philosophers_number))
+            for i in range(philosophers_number)
+        ]
+        self._hungry = [False] * philosophers_number
+        self._eating = [False] * philosophers_number
+        self._eating_since = [0.0] * philosophers_number if metrics is not None else None
+        # events are created lazily, only philosophers who wait for forks need them
+        self._fork_received: dict[int, asyncio.Event] = {}
+
+    def _get_forks(self, philosopher_index: int) -> tuple[ChandyMisraFork, ChandyMisraFork]:
+        left_index, right_index = get_forks_indexes(philosopher_index, self.philosophers_number)
+        return self.forks[left_index], self.forks[right_index]
+
+    def _pass_if_requested(self, fork: ChandyMisraFork) -> None:
+        if not fork.requested or not fork.dirty or self._eating[fork.owner]:
+            return
+        previous_owner = fork.owner
+        fork.owner = fork.get_other(previous_owner)
+        fork.dirty = False
+        # hungry philosopher who gave the fork away requests it back at once
+        fork.requested = self._hungry[previous_owner]
+        event = self._fork_received.get(fork.owner)
+        if event is not None:
+            event.set()
+
+    async def take_forks(self, philosopher_index: int) -> None:
+        forks = self._get_forks(philosopher_index)
+        if self.metrics is not None:
+            started_at = self.metrics.clock.now()
+            contended = [fork.owner != philosopher_index for fork in forks]
+        self._hungry[philosopher_index] = True
+        while True:
+            for fork in forks:
+                if fork.owner != philosopher_index:
+                    fork.requested = True
+                    self._pass_if_requested(fork)
+            if all(fork.owner == philosopher_index for fork in forks):
+                break
+
+            event = self._fork_received.setdefault(philosopher_index, asyncio.Event())
+            event.clear()
+            try:
+                await event.wait()
+            finally:
+                del self._fork_received[philosopher_index]
+
+        self._hungry[philosopher_index] = False
+        self._eating[philosopher_index] = True
+        if self.metrics is not None:
+            now = self._eating_since[philosopher_index] = self.metrics.clock.now()
+            for fork_index, fork_contended in zip(
+                get_forks_indexes(philosopher_index, self.philosophers_number), contended
+            ):
+                self.metrics.record_acquire(fork_index, now - started_at, fork_contended)
+
+    def put_forks(self, philosopher_index: int) -> None:
+        self._eating[philosopher_index] = False
+        if self.metrics is not None:
+            hold_time = self.metrics.clock.now() - self._eating_since[philosopher_index]
+            for fork_index in get_forks_indexes(philosopher_index, self.philosophers_number):
+                self.metrics.record_release(fork_index, hold_time)
+        for fork in self._get_forks(philosopher_index):
+            fork.dirty = True
+            # requests which were deferred while eating
+            self._pass_if_requested(fork)
+
+
+STRATEGIES: dict[str, type[Strategy]] = {
+    strategy.name: strategy
+    for strategy in (OrderedForksStrategy, WaiterStrategy, ChandyMisraStrategy)
+}
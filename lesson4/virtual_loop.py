@@ -0,0 +1,44 @@
+"""
+Event loop with virtual time.
+
+Philosophers only wait for timers and for each other, so there is no need to wait real time:
+when nothing is ready, the clock jumps straight to the next timer. Simulated hours take
+milliseconds, and with the seeded random generator every run gives the same results
+(callbacks are run in the same order, nothing depends on real time).
+"""
+import asyncio
+import selectors
+
+
+class VirtualTimeSelector(selectors.DefaultSelector):
+    def __init__(self, loop: "VirtualTimeEventLoop") -> None:
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout: float | None = None) -> list:
+        if timeout == 0:
+            # callbacks are ready, real file descriptors are checked at the next time jump
+            return []
+        # real file descriptors (for instance, the self-pipe used by Ctrl+C) are polled
+        # without blocking
+        events = super().select(0)
+        if events:
+            return events
+        if timeout is None:
+            # no timers and nothing ready: everybody waits for each other (deadlock),
+            # only Ctrl+C can wake the loop up
+            return super().select(None)
+        self._loop.advance_time(timeout)
+        return []
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self) -> None:
+        self._virtual_time = 0.0
+        super().__init__(VirtualTimeSelector(self))
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def advance_time(self, seconds: float) -> None:
+        self._virtual_time += seconds
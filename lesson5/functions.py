@@ -1,42 +1,104 @@
+import mmap
+
+from collections.abc import Iterable, Iterator
+
+from progress import ProgressSlot
+
 CHUNK_START_INDEX = 0
 CHUNK_END_INDEX = 1
 
+# Line format: word \t year \t match_count \t volume_count
+FIELDS_NUMBER = 4
+WORD_FIELD_INDEX = 0
+YEAR_FIELD_INDEX = 1
+MATCH_COUNT_FIELD_INDEX = 2
+# Chunk is processed by blocks, a block is split by one C call, so the block size is the memory
+# needed by a worker (block + its fields) and the step of progress monitoring.
+BLOCK_SIZE = 1024 * 1024
+
+
+def iter_blocks(
+    mm: mmap.mmap, chunk_start: int, chunk_end: int, block_size: int = BLOCK_SIZE
+) -> Iterator[bytes]:
+    """
+    Yields blocks of the chunk, every block (except possibly the last one) ends with a new line.
+    """
+    position = chunk_start
+    while position < chunk_end:
+        block_end = min(chunk_end, position + block_size)
+        if block_end < chunk_end:
+            line_end = mm.rfind(b"\n", position, block_end)
+            if line_end == -1:
+                # line is longer than the block
+                line_end = mm.find(b"\n", block_end, chunk_end)
+            block_end = chunk_end if line_end == -1 else line_end + 1
+        yield mm[position:block_end]
+        position = block_end
+
+
+def split_fields(block: bytes, fields_number: int = FIELDS_NUMBER) -> list[bytes]:
+    """
+    Returns fields of all lines of the block as one flat list, so the word of line `i` is
+    `fields[i * fields_number]`. Lines are not created as separate objects at all.
+    """
+    fields = block.replace(b"\n", b"\t").split(b"\t")
+    if block.endswith(b"\n"):
+        # the last new line gives an empty field
+        fields.pop()
+    if len(fields) % fields_number:
+        raise ValueError(f"Every line must have {fields_number} tab separated fields")
+    return fields
+
 
-def count_words(file_path: str, chunk: tuple[int, int], words_counter, words_counter_lock):
-    local_words_counter = 0
-    counter_step = 100_000
-    # Step is incredibly important, the process is really slow when step is small.
-    # I guess printing a lot of information to console makes a process slower.
+def select_word_years(
+    word: bytes, keys: Iterable[bytes], values: Iterable[int]
+) -> Iterator[tuple[bytes, int]]:
+    """
+    Map-reduce mapper: keys are "word \t year", yields (year, value) of lines of `word`.
+    """
+    word_prefix = word + b"\t"
+    for key, value in zip(keys, values):
+        if key.startswith(word_prefix):
+            yield key[len(word_prefix):], value
+
+
+def iter_line_starts(block: bytes, line_prefix: bytes) -> Iterator[int]:
+    """
+    Yields start positions of lines of the block which start with `line_prefix`.
+    """
+    if block.startswith(line_prefix):
+        yield 0
+    new_line_prefix = b"\n" + line_prefix
+    position = block.find(new_line_prefix)
+    while position != -1:
+        yield position + 1
+        position = block.find(new_line_prefix, position + 1)
+
+
+def count_word(file_path: str, chunk: tuple[int, int], word: str, progress: ProgressSlot) -> int:
+    """
+    Sums counts of one word only: lines which start with `word\t` are found by `bytes.find`,
+    other lines are not split at all and no dict is built.
+    """
     chunk_start = chunk[CHUNK_START_INDEX]
     chunk_end = chunk[CHUNK_END_INDEX]
-    words = {}
-
-    with open(file_path, "rb") as f:
-        # Here I use `rb` instead of `r`. I don't know if it's add something in our case, I tested
-        # several times, and it works the same. Maybe in some other cases/files the same position
-        # in bytes and text files can refer to different symbols.
-
-        f.seek(chunk_start)
-        for line in f:
-            chunk_start += len(line)
-            if chunk_start > chunk_end:
-                break
-
-            # As I mentioned above I use `rb`, that's why I need decode line here
-            _word, _, match_count, _ = line.decode("utf-8").strip().split("\t")
-
-            if _word in words:
-                words[_word] += int(match_count)
-            else:
-                words[_word] = int(match_count)
-
-            # monitoring
-            local_words_counter += 1
-            if local_words_counter % counter_step == 0:
-                local_words_counter = 0
-                with words_counter_lock:
-                    words_counter.value += counter_step
-        with words_counter_lock:
-            words_counter.value += local_words_counter
-
-    return words
+    line_prefix = word.encode("utf-8") + b"\t"
+    total_count = 0
+
+    with (
+        open(file_path, "rb") as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+        progress,
+    ):
+        for block in iter_blocks(mm, chunk_start, chunk_end):
+            for line_start in iter_line_starts(block, line_prefix):
+                line_end = block.find(b"\n", line_start)
+                fields = block[line_start:line_end if line_end != -1 else len(block)].split(b"\t")
+                if len(fields) != FIELDS_NUMBER:
+                    raise ValueError(f"Every line must have {FIELDS_NUMBER} tab separated fields")
+                total_count += int(fields[MATCH_COUNT_FIELD_INDEX])
+
+            # monitoring, once per block, the slot is written without a lock
+            progress.add(len(block))
+
+    return total_count
@@ -0,0 +1,137 @@
+"""
+Persistent index of word counts.
+
+The histogram of the gram file is saved once as a table sorted by word:
+
+    header | offsets of records (words number + 1) | records "word \t count \n"
+
+The index is memory-mapped and a word is found by binary search over offsets, so a lookup reads
+a few pages instead of the whole gram file. Size and modification time of the gram file are saved
+in the header, the index is not used when the gram file has changed.
+"""
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Iterable
+
+from mapreduce import iter_sorted_records
+
+MAGIC = b"L5INDEX1"
+# magic, source size, source modification time in nanoseconds, words number
+HEADER = struct.Struct("=8sQQQ")
+OFFSET_FORMAT = "Q"
+OFFSET_SIZE = 8
+INDEX_SUFFIX = ".index"
+
+
+def get_index_path(source_path: str) -> str:
+    return f"{source_path}{INDEX_SUFFIX}"
+
+
+def get_source_stamp(source_path: str) -> tuple[int, int]:
+    stat = os.stat(source_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_index(
+    index_path: str,
+    source_stamp: tuple[int, int],
+    words_number: int,
+    sorted_words: Iterable[tuple[bytes, int]],
+) -> None:
+    """
+    `source_stamp` must be taken before the gram file was read,
+    so the index of a file changed during the build is not valid.
+    """
+    offsets = array(OFFSET_FORMAT, [0])
+    records_start = HEADER.size + (words_number + 1) * OFFSET_SIZE
+    tmp_index_path = f"{index_path}.part"
+    with open(tmp_index_path, "wb") as f:
+        f.seek(records_start)
+        for word, count in sorted_words:
+            offsets.append(offsets[-1] + f.write(b"%s\t%d\n" % (word, count)))
+        if len(offsets) != words_number + 1:
+            raise ValueError(f"Expected {words_number} words, got {len(offsets) - 1}")
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, *source_stamp, words_number))
+        f.write(offsets.tobytes())
+    os.replace(tmp_index_path, index_path)
+
+
+def build_index(
+    index_path: str, source_stamp: tuple[int, int], words_number: int, partition_paths: list[str]
+) -> None:
+    """
+    `partition_paths` are reduced partitions of the histogram, see `MapReduce.run`.
+    """
+    write_index(index_path, source_stamp, words_number, iter_sorted_records(partition_paths))
+
+
+class WordIndex:
+    def __init__(self, index_path: str) -> None:
+        with open(index_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, source_size, source_mtime_ns, self.words_number = HEADER.unpack_from(self._mm)
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{index_path} is not an index file")
+        self.source_stamp = (source_size, source_mtime_ns)
+        self._records_start = HEADER.size + (self.words_number + 1) * OFFSET_SIZE
+        self._offsets = memoryview(self._mm)[HEADER.size:self._records_start].cast(OFFSET_FORMAT)
+
+    @classmethod
+    def open(cls, index_path: str, source_path: str) -> "WordIndex | None":
+        """
+        Returns None when there is no index or it was built for another version of the file.
+        """
+        try:
+            index = cls(index_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        if index.source_stamp != get_source_stamp(source_path):
+            index.close()
+            return None
+        return index
+
+    def __enter__(self) -> "WordIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        # memory view must be released before closing mmap
+        self._offsets.release()
+        self._mm.close()
+
+    def __len__(self) -> int:
+        return self.words_number
+
+    def _get_word(self, position: int) -> tuple[bytes, int]:
+        """
+        Returns the word of the record at `position` and the position of its count.
+        """
+        record_start = self._records_start + self._offsets[position]
+        word_end = self._mm.find(b"\t", record_start)
+        return self._mm[record_start:word_end], word_end + 1
+
+    def get(self, word: str) -> int:
+        key = word.encode("utf-8")
+        low, high = 0, self.words_number
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_word(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.words_number:
+            return 0
+        found_word, count_start = self._get_word(low)
+        if found_word != key:
+            return 0
+        record_end = self._records_start + self._offsets[low + 1]
+        return int(self._mm[count_start:record_end])
@@ -1,14 +1,27 @@
 import argparse
 import asyncio
-import multiprocessing as mp
-import os
-import time
+import tempfile
 
-from concurrent.futures import ProcessPoolExecutor
-from contextlib import contextmanager
-from math import ceil
+from functools import partial
 
-from functions import count_words
+from functions import (
+    FIELDS_NUMBER,
+    MATCH_COUNT_FIELD_INDEX,
+    WORD_FIELD_INDEX,
+    YEAR_FIELD_INDEX,
+    count_word,
+    select_word_years,
+)
+from index import WordIndex, build_index, get_index_path, get_source_stamp
+from mapreduce import (
+    EXECUTORS,
+    MapReduce,
+    get_file_chunks,
+    get_workers_number,
+    iter_sorted_records,
+    run_workers,
+    timer,
+)
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -21,153 +34,135 @@ parser.add_argument(
 )
 
 parser.add_argument("word", type=str, help= "Word")
+parser.add_argument(
+    "--histogram",
+    action="store_true",
+    help=(
+        "Count all words and merge them (slow and takes memory). "
+        "By default only lines of the word are summed."
+    ),
+)
+parser.add_argument(
+    "--partitions",
+    type=int,
+    default=None,
+    help=(
+        "Number of partitions of map-reduce (--histogram, --index, --per-year), partitions are "
+        "reduced in parallel. More partitions take less memory per partition, "
+        "the number of workers by default."
+    ),
+)
+parser.add_argument(
+    "--index",
+    action="store_true",
+    help=(
+        "Look the word up in the index of word counts, the index is built by the histogram "
+        "at the first run and is rebuilt when the file has changed."
+    ),
+)
+parser.add_argument(
+    "--index-path",
+    type=str,
+    default=None,
+    help="Path of the index, the file path with .index suffix by default.",
+)
+parser.add_argument(
+    "--per-year",
+    action="store_true",
+    help="Print counts of the word per year.",
+)
+parser.add_argument(
+    "--executor",
+    type=str,
+    choices=list(EXECUTORS),
+    default="process",
+    help="Pool of map-reduce workers (--histogram, --index, --per-year).",
+)
 
 
-DEFAULT_WORKERS_NUMBER = 16
-
-
-@contextmanager
-def timer(msg: str):
-    start = time.perf_counter()
-    yield
-    print(f"{msg}: {time.perf_counter() - start:.2f} seconds")
-
-
-def get_workers_number(max_workers: int = DEFAULT_WORKERS_NUMBER):
-    return min(os.cpu_count() or 1, max_workers)
-
-
-def get_current_line_number(file_path):
-    """
-    Function to get number of lines and not load whole file.
-    I need it for monitoring. I implemented another monitoring solution,
-    it counts how many bytes processed and show how many percentages of the file processed.
-    It allows to not get lines number and save several seconds.
-    """
-    file_size = os.path.getsize(file_path)
-    line_number = 1
-    buffer_size = 1024 * 1024  # 1 MB buffer size
-
-    with open(file_path, "rb") as f:
-        f.seek(file_size)
-        # Get current cursor position
-        current_position = f.tell()
-
-        # Move cursor to beginning of the file
-        f.seek(0)
-
-        # read file by chunks until current position
-        while f.tell() < current_position:
-            # if meet position, read only to current position
-            chunk_size = min(buffer_size, current_position - f.tell())
-            chunk = f.read(chunk_size)
-            line_number += chunk.count(b'\n')
-
-        f.seek(current_position)
-
-    return line_number
-
-
-def get_file_chunks(file_path: str, workers_number: int) -> list[tuple[int, int]]:
-    file_size = os.path.getsize(file_path)
-    chunk_size = ceil(file_size / workers_number)
-
-    chunks_info = []
-    with open(file_path, mode="rb") as f:
-
-        def is_new_line(position):
-            if position == 0:
-                return True
-            else:
-                f.seek(position - 1)
-                a = f.read(1)
-                return a == b"\n"
-
-        def next_line(position):
-            f.seek(position)
-            f.readline()
-            return f.tell()
-
-        chunk_start = 0
-        while chunk_start < file_size:
-            chunk_end = min(file_size, chunk_start + chunk_size)
-
-            while not is_new_line(chunk_end):
-                chunk_end -= 1
-
-            # Next condition is hardly possible. It can happen when file or chunk_size is too small.
-            # Or one line is whole chunk or even more (this also hardly possible with our files
-            # structure), etc. I reproduce it with 60 rows file.
-            if chunk_start == chunk_end:
-                chunk_end = next_line(chunk_end)
-
-            chunks_info.append((chunk_start, chunk_end))
-            chunk_start = chunk_end
-
-    return chunks_info
-
-
-def reduce_words(target: dict, source: dict) -> None:
-    for key, value in source.items():
-        target[key] = target.get(key, 0) + value
-
-
-async def monitoring(words_counter, words_counter_lock, total_words):
-    while True:
-        with words_counter_lock:
-            print(f"Progress {words_counter.value} / {total_words}")
-            if words_counter.value == total_words:
-                break
-        await asyncio.sleep(1)
+def make_histogram_job(args: argparse.Namespace, workers_number: int) -> MapReduce:
+    return MapReduce(
+        columns_number=FIELDS_NUMBER,
+        key_columns=(WORD_FIELD_INDEX,),
+        value_column=MATCH_COUNT_FIELD_INDEX,
+        executor=args.executor,
+        workers_number=workers_number,
+        partitions_number=args.partitions,
+    )
 
 
 async def main() -> None:
     args = parser.parse_args()
+    if args.partitions is not None and args.partitions < 1:
+        parser.error("--partitions must be positive")
     _file_path = args.filepath
     _word = args.word
 
-    loop = asyncio.get_event_loop()
     workers_number = get_workers_number()
 
-    with timer("Getting lines number"):
-        lines_number = get_current_line_number(_file_path)
-
-    with timer("Calculating file chunks indexes"):
-        file_chunks = get_file_chunks(_file_path, workers_number)
-
-    with mp.Manager() as manager:
-        counter = manager.Value("i", 0)
-        counter_lock = manager.Lock()
-
-        monitoring_task = asyncio.create_task(
-            monitoring(counter, counter_lock, lines_number)
+    if args.per_year:
+        # lines are grouped by (word, year) and the mapper keeps only lines of the word
+        job = MapReduce(
+            columns_number=FIELDS_NUMBER,
+            key_columns=(WORD_FIELD_INDEX, YEAR_FIELD_INDEX),
+            value_column=MATCH_COUNT_FIELD_INDEX,
+            mapper=partial(select_word_years, _word.encode("utf-8")),
+            executor=args.executor,
+            workers_number=workers_number,
+            partitions_number=args.partitions,
         )
-
-        with ProcessPoolExecutor(max_workers=workers_number) as executor:
-            with timer("Processing data"):
-                futures = []
-                for chunk in file_chunks:
-                    futures.append(
-                        loop.run_in_executor(
-                            executor, count_words, _file_path, chunk, counter, counter_lock
-                        )
+        with tempfile.TemporaryDirectory(prefix="lesson5-") as partitions_dir:
+            partitions = await job.run(_file_path, partitions_dir)
+            years = {
+                int(year): count
+                for year, count in iter_sorted_records([partition.path for partition in partitions])
+            }
+        for year, count in sorted(years.items()):
+            print(year, count)
+        print("Total count for word", sum(years.values()))
+        return
+
+    if args.index:
+        index_path = args.index_path or get_index_path(_file_path)
+        index = WordIndex.open(index_path, _file_path)
+        if index is None:
+            print(f"Building index {index_path}")
+            # taken before reading, so changes of the file during the build invalidate the index
+            source_stamp = get_source_stamp(_file_path)
+            with tempfile.TemporaryDirectory(prefix="lesson5-") as partitions_dir:
+                partitions = await make_histogram_job(args, workers_number).run(
+                    _file_path, partitions_dir
+                )
+                with timer("Building index"):
+                    build_index(
+                        index_path,
+                        source_stamp,
+                        sum(partition.keys_number for partition in partitions),
+                        [partition.path for partition in partitions],
                     )
-
-                done, _ = await asyncio.wait(futures)
-
-        try:
-            monitoring_task.cancel()
-            await monitoring_task
-        except asyncio.CancelledError:
-            pass
-
-    with timer("Reducing words"):
-        words = {}
-        for result in done:
-            reduce_words(words, result.result())
-
-    print("Total words", len(words))
-    print("Total count for word", words[_word])
+            index = WordIndex(index_path)
+        with index, timer("Index lookup"):
+            print("Total words", len(index))
+            print("Total count for word", index.get(_word))
+        return
+
+    if not args.histogram:
+        with timer("Calculating file chunks indexes"):
+            file_chunks = get_file_chunks(_file_path, workers_number)
+        # only one number is returned by every worker, there is nothing to reduce
+        results = await run_workers(count_word, _file_path, file_chunks, _word)
+        print("Total count for word", sum(results))
+        return
+
+    # words are not sent to the parent: workers write them to partition files by hash of the word,
+    # every partition is reduced by its own worker, so the parent memory doesn't depend on words
+    job = make_histogram_job(args, workers_number)
+    with tempfile.TemporaryDirectory(prefix="lesson5-") as partitions_dir:
+        partitions = await job.run(_file_path, partitions_dir)
+        word_count = job.get(partitions, _word.encode("utf-8")) if partitions else None
+
+    print("Total words", sum(partition.keys_number for partition in partitions))
+    print("Total count for word", word_count or 0)
 
 
 if __name__ == "__main__":
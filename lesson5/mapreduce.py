@@ -0,0 +1,376 @@
+"""
+Map-reduce over tab separated files.
+
+The file is split to chunks by lines, every chunk is mapped by its own worker (process or thread),
+values of the same key are combined in the worker, so only one value per key of the chunk
+is passed on. Combined values are written to partition files by hash of the key and every
+partition is reduced by its own worker, a key is in one partition only.
+Reduced partitions are text files "key \t value" sorted by key, so they are merged
+into one sorted stream without loading them.
+
+Keys are bytes (values of several key columns are joined by tab), values are integers.
+"""
+import asyncio
+import heapq
+import mmap
+import operator
+import os
+import time
+import zlib
+
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+from math import ceil
+from typing import NamedTuple
+
+from functions import CHUNK_END_INDEX, CHUNK_START_INDEX, iter_blocks, split_fields
+from progress import Progress, ProgressSlot
+
+DEFAULT_WORKERS_NUMBER = 16
+
+
+@contextmanager
+def timer(msg: str):
+    start = time.perf_counter()
+    yield
+    print(f"{msg}: {time.perf_counter() - start:.2f} seconds")
+
+
+def get_workers_number(max_workers: int = DEFAULT_WORKERS_NUMBER):
+    return min(os.cpu_count() or 1, max_workers)
+
+
+def get_file_chunks(file_path: str, workers_number: int) -> list[tuple[int, int]]:
+    """
+    A chunk ends after the first new line at or after its split point, the new line is found
+    by one forward search in the memory-mapped file (not by reading byte by byte backwards).
+    A chunk can be longer than others by one line, but never empty.
+    """
+    file_size = os.path.getsize(file_path)
+    if not file_size:
+        return []
+    chunk_size = ceil(file_size / workers_number)
+
+    chunks_info = []
+    with open(file_path, mode="rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        chunk_start = 0
+        while chunk_start < file_size:
+            # search from the byte before the split point, it can be the new line itself
+            line_end = mm.find(b"\n", min(file_size, chunk_start + chunk_size) - 1)
+            chunk_end = file_size if line_end == -1 else line_end + 1
+            chunks_info.append((chunk_start, chunk_end))
+            chunk_start = chunk_end
+
+    return chunks_info
+
+
+async def monitoring(progress: Progress, total_bytes: int):
+    """
+    Progress is measured in bytes, the total is the file size, so lines are not counted
+    before workers start.
+    """
+    while True:
+        # slots are read without a lock, a worker may be one block ahead of the printed value
+        processed_bytes = progress.get_total()
+        print(f"Progress {processed_bytes / total_bytes:.1%}")
+        if processed_bytes == total_bytes:
+            break
+        await asyncio.sleep(1)
+
+
+async def run_workers(
+    function,
+    file_path: str,
+    file_chunks: list[tuple[int, int]],
+    *args,
+    executor_class: type[Executor] = ProcessPoolExecutor,
+):
+    """
+    Runs `function(file_path, chunk, *args, progress_slot)` for every chunk
+    in a process (or thread) pool with progress monitoring, returns results of chunks.
+    Every chunk has its own progress slot in shared memory.
+    An empty file has no chunks, there is nothing to run and no progress to measure.
+    """
+    if not file_chunks:
+        return []
+    loop = asyncio.get_running_loop()
+
+    total_bytes = sum(chunk_end - chunk_start for chunk_start, chunk_end in file_chunks)
+
+    with Progress(len(file_chunks)) as progress:
+        monitoring_task = asyncio.create_task(monitoring(progress, total_bytes))
+
+        with executor_class(max_workers=len(file_chunks)) as executor:
+            with timer("Processing data"):
+                futures = []
+                for index, chunk in enumerate(file_chunks):
+                    futures.append(
+                        loop.run_in_executor(
+                            executor, function, file_path, chunk, *args, progress.get_slot(index)
+                        )
+                    )
+
+                results = await asyncio.gather(*futures)
+
+        try:
+            monitoring_task.cancel()
+            await monitoring_task
+        except asyncio.CancelledError:
+            pass
+
+    return results
+
+
+EXECUTORS: dict[str, type[Executor]] = {
+    "process": ProcessPoolExecutor,
+    "thread": ThreadPoolExecutor,
+}
+KEY_SEPARATOR = b"\t"
+# key \t value
+RECORD_FIELDS_NUMBER = 2
+REDUCED_PARTITION_NAME = "reduced"
+
+Mapper = Callable[[Iterable[bytes], Iterable[int]], Iterable[tuple[bytes, int]]]
+Combiner = Callable[[int, int], int]
+
+
+def get_key_partition(key: bytes, partitions_number: int) -> int:
+    # unlike `hash` of bytes, crc32 doesn't depend on the process
+    return zlib.crc32(key) % partitions_number
+
+
+def get_partition_path(partitions_dir: str, partition: int, name: str | int) -> str:
+    return os.path.join(partitions_dir, f"{partition}.{name}")
+
+
+def write_records(file_path: str, records: Iterable[tuple[bytes, int]]) -> None:
+    with open(file_path, "wb") as f:
+        f.write(b"".join(b"%s\t%d\n" % record for record in records))
+
+
+def read_records(file_path: str) -> Iterator[tuple[bytes, int]]:
+    """
+    Reads "key \t value" lines lazily, the key can contain tabs itself.
+    """
+    with open(file_path, "rb") as f:
+        for line in f:
+            key, _, value = line.rstrip(b"\n").rpartition(b"\t")
+            yield key, int(value)
+
+
+def read_partition(file_path: str) -> Iterable[tuple[bytes, int]]:
+    """
+    Reads all records of the file at once. When keys have no tabs (one tab per line),
+    the file is split by one C call as blocks of the gram file, not line by line.
+    """
+    with open(file_path, "rb") as f:
+        data = f.read()
+    if data.count(b"\t") != data.count(b"\n"):
+        return read_records(file_path)
+    fields = split_fields(data, RECORD_FIELDS_NUMBER)
+    return zip(fields[::RECORD_FIELDS_NUMBER], map(int, fields[1::RECORD_FIELDS_NUMBER]))
+
+
+def iter_sorted_records(partition_paths: list[str]) -> Iterator[tuple[bytes, int]]:
+    """
+    Reduced partitions are sorted, they are merged into one sorted stream.
+    """
+    return heapq.merge(*(read_records(path) for path in partition_paths))
+
+
+def combine_runs(
+    pairs: Iterable[tuple[bytes, int]], combiner: Combiner, combined: dict[bytes, int]
+) -> None:
+    """
+    Lines of the same key go one after another in n-gram files, so the value is combined
+    while the key is the same and the dict is updated once per run of the key, not once per line.
+    """
+    current_key = None
+    current_value = 0
+    if combiner is operator.add:
+        # the most common case is a sum, the operator is faster than the function call
+        for key, value in pairs:
+            if key == current_key:
+                current_value += value
+                continue
+            if current_key is not None:
+                combined[current_key] = combined.get(current_key, 0) + current_value
+            current_key = key
+            current_value = value
+        if current_key is not None:
+            combined[current_key] = combined.get(current_key, 0) + current_value
+        return
+
+    for key, value in pairs:
+        if key == current_key:
+            current_value = combiner(current_value, value)
+            continue
+        if current_key is not None:
+            combine_value(combined, current_key, current_value, combiner)
+        current_key = key
+        current_value = value
+    if current_key is not None:
+        combine_value(combined, current_key, current_value, combiner)
+
+
+def combine_value(combined: dict[bytes, int], key: bytes, value: int, combiner: Combiner) -> None:
+    if key in combined:
+        combined[key] = combiner(combined[key], value)
+    else:
+        combined[key] = value
+
+
+class PartitionResult(NamedTuple):
+    path: str
+    keys_number: int
+
+
+class MapReduce:
+    """
+    Every line of the file is split to `columns_number` columns. The key is the value of one
+    of `key_columns`, values of several columns joined by tab (grouping) or `b""` for one total.
+    The value is `value_column` parsed by `int`.
+    `mapper(keys, values)` gets keys and values of lines of a block and yields (key, value)
+    pairs, it can filter lines and change keys and values, pairs are passed as is by default.
+    Values of the same key are combined by `combiner` in a worker and by `reducer`
+    (the combiner by default) when partitions are reduced.
+    Functions are pickled for the process pool, they must be defined at a module level
+    (`functools.partial` of such a function is fine).
+    """
+
+    def __init__(
+        self,
+        columns_number: int,
+        key_columns: tuple[int, ...],
+        value_column: int,
+        mapper: Mapper = zip,
+        combiner: Combiner = operator.add,
+        reducer: Combiner | None = None,
+        executor: str = "process",
+        workers_number: int | None = None,
+        partitions_number: int | None = None,
+    ) -> None:
+        if executor not in EXECUTORS:
+            raise ValueError(f"Executor must be one of {list(EXECUTORS)}")
+        for column in (*key_columns, value_column):
+            if not 0 <= column < columns_number:
+                raise ValueError(f"Column {column} is not in range of {columns_number} columns")
+        self.columns_number = columns_number
+        self.key_columns = key_columns
+        self.value_column = value_column
+        self.mapper = mapper
+        self.combiner = combiner
+        self.reducer = reducer or combiner
+        self.executor = executor
+        self.workers_number = workers_number or get_workers_number()
+        self.partitions_number = partitions_number or self.workers_number
+
+    def _get_keys(self, fields: list[bytes]) -> Iterable[bytes]:
+        if not self.key_columns:
+            return repeat(b"", len(fields) // self.columns_number)
+        columns = [fields[column::self.columns_number] for column in self.key_columns]
+        return columns[0] if len(columns) == 1 else map(KEY_SEPARATOR.join, zip(*columns))
+
+    def map_chunk(
+        self,
+        file_path: str,
+        chunk: tuple[int, int],
+        partitions_dir: str,
+        progress: ProgressSlot,
+    ) -> list[str]:
+        """
+        Maps and combines lines of the chunk, writes combined values to partition files,
+        returns paths of the files indexed by partition.
+        The file is memory-mapped and split by blocks, lines are not created as objects,
+        values are parsed from bytes.
+        """
+        combined: dict[bytes, int] = {}
+
+        with (
+            open(file_path, "rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+            progress,
+        ):
+            for block in iter_blocks(mm, chunk[CHUNK_START_INDEX], chunk[CHUNK_END_INDEX]):
+                fields = split_fields(block, self.columns_number)
+                # keys and values are not kept in variables, so they are freed right after
+                # the block and their memory is reused (still in cache) by the next block
+                combine_runs(
+                    self.mapper(
+                        self._get_keys(fields),
+                        map(int, fields[self.value_column::self.columns_number]),
+                    ),
+                    self.combiner,
+                    combined,
+                )
+                # monitoring, once per block, the slot is written without a lock
+                progress.add(len(block))
+
+        partitions: list[list[tuple[bytes, int]]] = [[] for _ in range(self.partitions_number)]
+        for record in combined.items():
+            partitions[get_key_partition(record[0], self.partitions_number)].append(record)
+
+        partition_paths = []
+        for partition, records in enumerate(partitions):
+            partition_path = get_partition_path(partitions_dir, partition, chunk[CHUNK_START_INDEX])
+            write_records(partition_path, records)
+            partition_paths.append(partition_path)
+        return partition_paths
+
+    def reduce_partition(self, partition_paths: list[str], output_path: str) -> PartitionResult:
+        """
+        Reduces files of one partition (one file per chunk) into `output_path` sorted by key
+        and removes them.
+        """
+        reduced: dict[bytes, int] = {}
+        for partition_path in partition_paths:
+            # keys of a file are unique, every run is one record
+            combine_runs(read_partition(partition_path), self.reducer, reduced)
+            os.remove(partition_path)
+
+        write_records(output_path, sorted(reduced.items()))
+        return PartitionResult(output_path, len(reduced))
+
+    async def run(self, file_path: str, partitions_dir: str) -> list[PartitionResult]:
+        """
+        Returns reduced partitions, they are written to `partitions_dir`.
+        """
+        with timer("Calculating file chunks indexes"):
+            file_chunks = get_file_chunks(file_path, self.workers_number)
+        if not file_chunks:
+            return []
+        executor_class = EXECUTORS[self.executor]
+        loop = asyncio.get_running_loop()
+
+        partitions_paths = await run_workers(
+            self.map_chunk,
+            file_path,
+            file_chunks,
+            partitions_dir,
+            executor_class=executor_class,
+        )
+        with timer("Reducing"), executor_class(max_workers=self.workers_number) as executor:
+            return await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        executor,
+                        self.reduce_partition,
+                        list(partition_paths),
+                        get_partition_path(partitions_dir, partition, REDUCED_PARTITION_NAME),
+                    )
+                    for partition, partition_paths in enumerate(zip(*partitions_paths))
+                )
+            )
+
+    def get(self, partitions: list[PartitionResult], key: bytes) -> int | None:
+        """
+        Looks the key up in the reduced partition of this key, other partitions are not read.
+        """
+        for record_key, value in read_records(
+            partitions[get_key_partition(key, self.partitions_number)].path
+        ):
+            if record_key == key:
+                return value
+        return None
@@ -0,0 +1,66 @@
+"""
+Progress of workers in shared memory.
+
+Every worker has its own slot with the number of processed bytes and only this worker writes it,
+so there is no lock: an update is one store to memory, the monitor sums the slots.
+"""
+from multiprocessing import shared_memory
+
+# unsigned 8 bytes, aligned slots are written and read by one instruction
+SLOT_FORMAT = "Q"
+SLOT_SIZE = 8
+
+
+class ProgressSlot:
+    """
+    Worker side. Only the name of shared memory is pickled, it's attached by `with slot:`.
+    """
+
+    def __init__(self, shared_memory_name: str, index: int) -> None:
+        self.shared_memory_name = shared_memory_name
+        self.index = index
+        self.value = 0
+
+    def __enter__(self) -> "ProgressSlot":
+        self._shared_memory = shared_memory.SharedMemory(name=self.shared_memory_name)
+        self._slots = self._shared_memory.buf.cast(SLOT_FORMAT)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        # memory view must be released before closing, shared memory is unlinked by the owner
+        self._slots.release()
+        self._shared_memory.close()
+
+    def add(self, bytes_number: int) -> None:
+        self.value += bytes_number
+        self._slots[self.index] = self.value
+
+
+class Progress:
+    """
+    Owner side: creates shared memory with `slots_number` slots and unlinks it on exit.
+    """
+
+    def __init__(self, slots_number: int) -> None:
+        self.slots_number = slots_number
+        self._shared_memory = shared_memory.SharedMemory(
+            create=True, size=max(slots_number, 1) * SLOT_SIZE
+        )
+        # size can be rounded up to the page size, the tail is not used
+        self._slots = self._shared_memory.buf.cast(SLOT_FORMAT)
+        for index in range(slots_number):
+            self._slots[index] = 0
+
+    def __enter__(self) -> "Progress":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._slots.release()
+        self._shared_memory.close()
+        self._shared_memory.unlink()
+
+    def get_slot(self, index: int) -> ProgressSlot:
+        return ProgressSlot(self._shared_memory.name, index)
+
+    def get_total(self) -> int:
+        return sum(self._slots[index] for index in range(self.slots_number))